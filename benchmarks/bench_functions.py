@@ -0,0 +1,75 @@
+"""
+Extract the changed functions of every Python file in the history of a git
+repository, this one by default, from the patch alone and with `ast` over
+the file at the commit, and compare speed and what they find.
+
+    python benchmarks/bench_functions.py --repo .cache/mirrors/PrefectHQ/prefect.git --max-commits 2000
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions import changed_functions  # noqa: E402
+from git_source import BlobReader, iter_commit_batches  # noqa: E402
+
+
+def percentile(values, q):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repo', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    parser.add_argument('--max-commits', type=int, default=1000)
+    args = parser.parse_args()
+
+    files = []
+    started = time.perf_counter()
+    for batch in iter_commit_batches(args.repo, 'bench/repo', max_commits=args.max_commits, resolve_sources=False):
+        for record in batch:
+            files.extend((record['id'], file) for file in record['files']
+                         if file['filename'].endswith('.py') and file['patch'] != 'NONE')
+    print(f"{len(files)} Python file patches from {args.repo}, read in {time.perf_counter() - started:.2f}s")
+
+    blobs = BlobReader(args.repo)
+    sources = []
+    started = time.perf_counter()
+    for sha, file in files:
+        sources.append(blobs.read(sha, file['filename']))
+    blobs.close()
+    read = time.perf_counter() - started
+    print(f"  read the files at their commits in {read:.2f}s, {read / max(len(files), 1) * 1000:.3f} ms a file")
+
+    results = {}
+    for name, with_source in (('patch only', False), ('ast', True)):
+        latencies = []
+        found = []
+        for (sha, file), source in zip(files, sources):
+            started = time.perf_counter()
+            found.append(changed_functions(file['filename'], file['patch'], source if with_source else None))
+            latencies.append(time.perf_counter() - started)
+        results[name] = found
+        print(f"  {name:<10} {sum(latencies):7.3f}s total  p50 {percentile(latencies, 50) * 1000:7.3f} ms  "
+              f"p99 {percentile(latencies, 99) * 1000:7.3f} ms  {sum(map(len, found)):>6} functions, "
+              f"{sum(1 for names in found if not names):>5} files with none")
+
+    # how much of what the patch alone names ast confirms, and what it adds
+    confirmed = added = total = 0
+    for patch_only, resolved in zip(results['patch only'], results['ast']):
+        confirmed += len(set(patch_only) & set(resolved))
+        added += len(set(resolved) - set(patch_only))
+        total += len(set(patch_only))
+    print(f"  ast confirms {confirmed} of {total} patch only names and finds {added} more")
+    head = subprocess.run(['git', '-C', args.repo, 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True)
+    print(f"  corpus at {head.stdout.strip()}")
+
+
+if __name__ == '__main__':
+    main()
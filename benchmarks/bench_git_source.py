@@ -0,0 +1,137 @@
+"""
+Read a throwaway local repository through the git backend, offline: first a
+small history with the paths that are easy to get wrong (spaces, non-ASCII,
+a tab, a rename, a binary file and a merge), checked against what the
+records must hold, then `--commits` generated commits for throughput.
+
+    python benchmarks/bench_git_source.py --commits 2000
+
+Exits with status 1 when a record is wrong.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from git_source import iter_commit_batches  # noqa: E402
+
+REPO = 'bench/git-source'
+
+
+def git(path, *args):
+    subprocess.run(['git', '-C', path, '-c', 'user.name=Bench', '-c', 'user.email=bench@example.com', *args],
+                   check=True, capture_output=True)
+
+
+def write(path, filename, content):
+    full = os.path.join(path, filename)
+    os.makedirs(os.path.dirname(full), exist_ok=True)
+    with open(full, 'wb') as f:
+        f.write(content if isinstance(content, bytes) else content.encode())
+
+
+def commit(path, message):
+    git(path, 'add', '-A')
+    git(path, 'commit', '-q', '-m', message)
+
+
+def init(path):
+    os.makedirs(path)
+    git(path, 'init', '-q', '-b', 'main')
+
+
+def build_fixture(path):
+    """The history checked against EXPECTED"""
+    init(path)
+    write(path, 'my b/file.txt', 'one\n')
+    write(path, 'café.py', 'def greet(name):\n    return name\n')
+    write(path, 'tab\there.txt', 'tab\n')
+    write(path, 'logo.bin', bytes(range(256)))
+    commit(path, 'Add the fixture files')
+
+    write(path, 'café.py', 'def greet(name):\n    return f"hello {name}"\n')
+    os.renames(os.path.join(path, 'my b/file.txt'), os.path.join(path, 'docs/new name.md'))
+    commit(path, 'Rename a path with spaces')
+
+    git(path, 'checkout', '-q', '-b', 'side')
+    write(path, 'side.py', 'class Side:\n    def run(self):\n        return 1\n')
+    commit(path, 'Add side')
+    git(path, 'checkout', '-q', 'main')
+    write(path, 'tab\there.txt', 'tab\ntab\n')
+    commit(path, 'Change the path with a tab')
+    git(path, 'merge', '-q', '--no-ff', '-m', "Merge branch 'side'", 'side')
+
+
+# what the records of build_fixture hold, newest first
+EXPECTED = [
+    ("Merge branch 'side'", 2, {'side.py': ['Side', 'run']}),
+    ('Change the path with a tab', 1, {'tab\there.txt': []}),
+    ('Add side', 1, {'side.py': ['Side', 'run']}),
+    ('Rename a path with spaces', 1, {'café.py': ['greet'], 'docs/new name.md': []}),
+    ('Add the fixture files', 0, {'café.py': ['greet'], 'logo.bin': [], 'my b/file.txt': [],
+                                  'tab\there.txt': []}),
+]
+
+
+def check_fixture(path):
+    records = [record for batch in iter_commit_batches(path, REPO) for record in batch]
+    problems = []
+    if len(records) != len(EXPECTED):
+        problems.append(f"{len(records)} records instead of {len(EXPECTED)}")
+    for record, (message, parents, files) in zip(records, EXPECTED):
+        found = {file['filename']: file['functions'] for file in record['files']}
+        if record['commit_message'] != message:
+            problems.append(f"message {record['commit_message']!r} instead of {message!r}")
+        if len(record['parents']) != parents:
+            problems.append(f"{message}: {len(record['parents'])} parents instead of {parents}")
+        if found != files:
+            problems.append(f"{message}: files {found} instead of {files}")
+        for file in record['files']:
+            if not file['raw_url'].endswith('/' + file['filename'].replace(' ', '%20').replace('\t', '%09')
+                                            .replace('é', '%C3%A9')):
+                problems.append(f"{message}: raw_url {file['raw_url']!r} for {file['filename']!r}")
+        if not record['url'].endswith('/' + record['id']):
+            problems.append(f"{message}: url {record['url']!r} doesn't end in the sha {record['id']!r}")
+    return problems
+
+
+def build_history(path, commits):
+    init(path)
+    for number in range(commits):
+        write(path, f"pkg/module_{number % 20}.py",
+              ''.join(f"def handler_{f}(value):\n    return value + {number}\n\n\n" for f in range(5)))
+        commit(path, f"Change {number}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--commits', type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench-git-') as root:
+        fixture = os.path.join(root, 'fixture')
+        build_fixture(fixture)
+        problems = check_fixture(fixture)
+        for problem in problems:
+            print(f"  wrong: {problem}")
+        print(f"fixture history: {'ok' if not problems else f'{len(problems)} problems'}")
+
+        history = os.path.join(root, 'history')
+        started = time.perf_counter()
+        build_history(history, args.commits)
+        print(f"{args.commits} commits generated in {time.perf_counter() - started:.1f}s")
+        for resolve_sources in (False, True):
+            started = time.perf_counter()
+            count = sum(len(batch) for batch in iter_commit_batches(history, REPO, resolve_sources=resolve_sources))
+            seconds = time.perf_counter() - started
+            print(f"  {'ast' if resolve_sources else 'patch only':<10} {count} records in {seconds:.2f}s, "
+                  f"{count / seconds:.0f} commits/s")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
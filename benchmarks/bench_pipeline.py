@@ -0,0 +1,187 @@
+"""
+Throughput of the flow and its stages against local stand-ins for GitHub,
+Ollama and Neo4j, no network or services needed.
+
+    python benchmarks/bench_pipeline.py --sizes 10,1000,10000 --github-latency 0.02 --ollama-delay 0.05
+
+For every size it reports commits per second and p50/p99 latency of the
+listing, detail fetch, summarize and ingest stages, the pipelined run, and
+get_repo_info when Prefect is installed, with the peak RSS of the process so far.
+"""
+import argparse
+import asyncio
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import FakeGitHub, FakeOllama  # noqa: E402
+from github_api import commit_record, fetch_commit_detail, iter_commit_pages, make_async_client  # noqa: E402
+from graph import RecordingGraph, ingest_commits  # noqa: E402
+from pipeline import run_pipeline  # noqa: E402
+from summarize import Summarizer  # noqa: E402
+from summary_parser import parse_summary  # noqa: E402
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kilobytes on Linux
+
+
+def report(name, count, seconds, latencies=None):
+    if latencies:
+        spread = (f"p50 {percentile(latencies, 50) * 1000:>8.1f} ms  "
+                  f"p99 {percentile(latencies, 99) * 1000:>8.1f} ms")
+    else:
+        spread = f"{'':<30}"
+    print(f"  {name:<14} {count:>7} items {count / seconds if seconds else 0:>9.1f}/s  {spread}  "
+          f"peak RSS {peak_rss_mb():>7.1f} MiB")
+
+
+def _timing(latencies, function):
+    """Wrap a coroutine function to record how long each call takes"""
+    async def timed(*args, **kwargs):
+        started = time.perf_counter()
+        result = await function(*args, **kwargs)
+        latencies.append(time.perf_counter() - started)
+        return result
+
+    return timed
+
+
+async def _limited(semaphore, function, *args):
+    async with semaphore:
+        return await function(*args)
+
+
+async def bench_stages(url, ollama_host, concurrency, summary_concurrency, batch_size):
+    # listing
+    latencies = []
+    listing = []
+    started = last = time.perf_counter()
+    for page in iter_commit_pages(url, headers={}, per_page=100):
+        now = time.perf_counter()
+        latencies.append(now - last)
+        last = now
+        listing.extend(page)
+    report('list pages', len(listing), time.perf_counter() - started, latencies)
+
+    # detail fetch
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    started = time.perf_counter()
+    fetch = _timing(latencies, fetch_commit_detail)
+    async with make_async_client(headers={}, max_connections=concurrency) as client:
+        # latency of the requests themselves, not of waiting for a free slot
+        details = await asyncio.gather(*(_limited(semaphore, fetch, client, commit['url']) for commit in listing))
+    report('detail fetch', len(details), time.perf_counter() - started, latencies)
+    records = [commit_record(commit, detail) for commit, detail in zip(listing, details)]
+
+    summarized = await bench_summarize(records, ollama_host, summary_concurrency)
+
+    # ingest, into the in-memory graph so this is the cost of building the batches
+    rows = [{'commit': commit, 'summary': parse_summary(commit['summary']).as_dict()}
+            for commit in summarized if commit is not None]
+    graph = RecordingGraph()
+    latencies = []
+    started = time.perf_counter()
+    for i in range(0, len(rows), batch_size):
+        batch_started = time.perf_counter()
+        ingest_commits(graph, rows[i:i + batch_size], batch_size)
+        latencies.append(time.perf_counter() - batch_started)
+    report('ingest batches', len(rows), time.perf_counter() - started, latencies)
+    return records
+
+
+async def bench_summarize(records, ollama_host, concurrency, stream=True, name='summarize'):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    # every commit goes to the model, triage would skip none of the fake ones anyway
+    summarizer = Summarizer(concurrency=concurrency, host=ollama_host, triage=False, stream=stream)
+    started = time.perf_counter()
+    await summarizer.warm_up()
+    # time the requests, not the wait for a free slot
+    summarizer.chat = _timing(latencies, summarizer.chat)
+    summarized = await asyncio.gather(*(_limited(semaphore, summarizer.summarize, dict(record))
+                                        for record in records))
+    report(name, len(summarized), time.perf_counter() - started, latencies)
+    return summarized
+
+
+def bench_pipeline(url, ollama_host, concurrency, summary_concurrency, batch_size):
+    stats = asyncio.run(run_pipeline(
+        url, RecordingGraph(), {'per_page': 100}, fetch_concurrency=concurrency,
+        summary_concurrency=summary_concurrency, batch_size=batch_size, flush_interval=0.5, ollama_host=ollama_host
+    ))
+    report('pipeline', stats['ingested'], stats['seconds'])
+    print(f"  {'':<14} first commits ingested after {stats['first_ingest_seconds'] or 0:.2f}s, "
+          f"{stats['failed']} failed")
+
+
+def bench_flow(url, batch_size):
+    try:
+        import main
+    except ImportError as e:
+        print(f"  get_repo_info  skipped, {e}")
+        return
+    graph = RecordingGraph()
+    # the flow connects to Neo4j itself, hand it the in-memory graph instead
+    main.Neo4jWriter.from_env = staticmethod(lambda: graph)
+    started = time.perf_counter()
+    main.get_repo_info(url, batch_size=batch_size, max_pages=None)
+    ingested = sum(len(params['batch']) for query, params in graph.writes if params and 'batch' in params)
+    report('get_repo_info', ingested, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10,1000,10000')
+    parser.add_argument('--github-latency', type=float, default=0.01)
+    parser.add_argument('--rate-limit', type=int, default=1000000)
+    parser.add_argument('--ollama-delay', type=float, default=0.02)
+    parser.add_argument('--ollama-parallel', type=int, default=4)
+    parser.add_argument('--ollama-trailing', type=int, default=0,
+                        help='whitespace tokens the fake model generates after the JSON object')
+    parser.add_argument('--ollama-load-delay', type=float, default=0.0)
+    parser.add_argument('--compare-streaming', action='store_true',
+                        help='summarize every size again with and without streaming, each on a fresh server')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--skip-flow', action='store_true', help="don't run get_repo_info through Prefect")
+    args = parser.parse_args()
+
+    # caches, sync state and mirrors live under ./.cache, keep them out of the working tree
+    os.chdir(tempfile.mkdtemp(prefix='bench-'))
+    for size in (int(size) for size in args.sizes.split(',')):
+        ollama_args = (args.ollama_delay, args.ollama_parallel, args.ollama_trailing, args.ollama_load_delay)
+        with FakeGitHub(size, args.github_latency, args.rate_limit) as github, FakeOllama(*ollama_args) as ollama:
+            os.environ['OLLAMA_HOST'] = ollama.url
+            url = f"{github.url}/repos/bench/repo{size}/commits"
+            print(f"{size} commits, GitHub latency {args.github_latency * 1000:.0f} ms, "
+                  f"Ollama delay {args.ollama_delay * 1000:.0f} ms x {args.ollama_parallel}")
+            records = asyncio.run(bench_stages(url, ollama.url, args.concurrency, args.ollama_parallel,
+                                               args.batch_size))
+            bench_pipeline(url, ollama.url, args.concurrency, args.ollama_parallel, args.batch_size)
+            if not args.skip_flow:
+                bench_flow(url, args.batch_size)
+        if args.compare_streaming:
+            for stream in (False, True):
+                with FakeOllama(*ollama_args) as ollama:
+                    asyncio.run(bench_summarize(records, ollama.url, args.ollama_parallel, stream,
+                                                'streamed' if stream else 'whole'))
+                print(f"  {'':<14} {ollama.loads} model loads, {ollama.cancelled} answers cut short")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Compare parse_summary with the recursive parse_stringified_json it replaced
+on large nested model output.
+
+    python benchmarks/bench_summary_parser.py
+"""
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from summary_parser import parse_summary  # noqa: E402
+
+
+def parse_stringified_json(obj):
+    # the implementation previously copied into main.py and repo.py
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            obj[key] = parse_stringified_json(value)
+    elif isinstance(obj, list):
+        return [parse_stringified_json(item) for item in obj]
+    elif isinstance(obj, str):
+        try:
+            if re.match(r'^\[.*\]$', obj.strip()) or re.match(r'^\{.*\}$', obj.strip()):
+                return parse_stringified_json(json.loads(obj))
+        except json.JSONDecodeError:
+            pass
+    return obj
+
+
+def payload(files, lines_per_patch):
+    """Model output in the shape the old prompt asked for, every file echoing its patch"""
+    patch = '\n'.join(f"+    value_{i} = compute(value_{i - 1})" for i in range(lines_per_patch))
+    return json.dumps({
+        'Files': [
+            {
+                'filename': f"src/module_{i}.py",
+                'raw_url': f"https://github.com/o/r/raw/sha/src/module_{i}.py",
+                'patch': patch,
+                'Functions': [f"function_{i}_{j}" for j in range(5)]
+            }
+            for i in range(files)
+        ],
+        'Functions': json.dumps([f"function_{i}" for i in range(files)]),
+        'Summary': 'Refactors the compute pipeline. ' * 20,
+        'Importance': 3
+    })
+
+
+def legacy(text):
+    return parse_stringified_json(json.loads(text))
+
+
+def main():
+    for files, lines in ((10, 20), (100, 50), (500, 100)):
+        text = payload(files, lines)
+        number = max(1, 2000 // files)
+        old = min(timeit.repeat(lambda: legacy(text), number=number, repeat=5)) / number
+        new = min(timeit.repeat(lambda: parse_summary(text), number=number, repeat=5)) / number
+        print(f"{files:>4} files, {len(text) / 1024:>8.1f} KiB: "
+              f"parse_stringified_json {old * 1000:8.3f} ms, parse_summary {new * 1000:8.3f} ms, "
+              f"{old / new:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+"""
+Local stand-ins for the GitHub REST API and Ollama's /api/chat, served on
+127.0.0.1 from background threads so the flows can be measured offline.
+"""
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def fake_sha(repo, number):
+    return hashlib.sha1(f"{repo}:{number}".encode()).hexdigest()
+
+
+def fake_patch(number, functions=3, lines=8):
+    """Adds `lines` lines to the body of every function of fake_source"""
+    hunks = []
+    for f in range(functions):
+        start = f * (lines + 4) + 2
+        body = '\n'.join(f"+    value = step_{number}_{f}(value, {i})" for i in range(lines))
+        hunks.append(f"@@ -{start - f * lines},2 +{start},{lines + 2} @@ def handler_{f}(value):\n     value = 0\n"
+                     f"{body}\n     return value")
+    return '\n'.join(hunks)
+
+
+def fake_source(number, functions=3, lines=8):
+    """The file fake_patch leaves behind"""
+    blocks = []
+    for f in range(functions):
+        body = '\n'.join(f"    value = step_{number}_{f}(value, {i})" for i in range(lines))
+        blocks.append(f"def handler_{f}(value):\n    value = 0\n{body}\n    return value\n")
+    return '\n'.join(blocks)
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    # the default backlog of 5 drops connects when a pooled client opens many at once
+    request_queue_size = 256
+
+
+class _Server:
+    handler = None
+
+    def __init__(self):
+        self._server = _HTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(self.handler):
+            owner = server
+
+        return Handler
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so the pooled clients reuse connections
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_text(self, status, text):
+        data = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _GitHubHandler(_Handler):
+    def do_GET(self):
+        github = self.owner
+        time.sleep(github.latency)
+        parsed = urlparse(self.path)
+        parts = parsed.path.strip('/').split('/')
+        if len(parts) > 4 and parts[2] == 'raw':
+            # /{owner}/{repo}/raw/{sha}/{path}, the raw file host, no quota
+            return self.send_text(200, github.source(parts[3]))
+        headers = github.rate_limit_headers()
+        if len(parts) < 4 or parts[0] != 'repos' or parts[3] != 'commits':
+            return self.send_json(404, {'message': 'Not Found'}, headers)
+        repo = f"{parts[1]}/{parts[2]}"
+        if len(parts) == 5:
+            return self.send_json(200, github.detail(repo, parts[4]), headers)
+        query = parse_qs(parsed.query)
+        per_page = min(int(query.get('per_page', ['30'])[0]), 100)
+        page = int(query.get('page', ['1'])[0])
+        items = github.listing(repo, page, per_page)
+        if page * per_page < github.commits:
+            headers['Link'] = f'<{github.url}/repos/{repo}/commits?per_page={per_page}&page={page + 1}>; rel="next"'
+        self.send_json(200, items, headers)
+
+
+class FakeGitHub(_Server):
+    """
+    A repository of `commits` commits behind the /repos/{repo}/commits listing
+    (paginated with Link headers) and commit detail endpoints, answering after
+    `latency` seconds with X-RateLimit headers counting down from `rate_limit`.
+    """
+    handler = _GitHubHandler
+
+    def __init__(self, commits=100, latency=0.0, rate_limit=5000, files_per_commit=2):
+        super().__init__()
+        self.commits = commits
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.files_per_commit = files_per_commit
+        self.requests = 0
+        self._reset = int(time.time()) + 3600
+        self._lock = threading.Lock()
+        self._numbers = {}
+
+    def rate_limit_headers(self):
+        with self._lock:
+            self.requests += 1
+            remaining = max(self.rate_limit - self.requests, 0)
+        return {'X-RateLimit-Limit': str(self.rate_limit), 'X-RateLimit-Remaining': str(remaining),
+                'X-RateLimit-Reset': str(self._reset)}
+
+    def listing(self, repo, page, per_page):
+        items = []
+        for number in range((page - 1) * per_page, min(page * per_page, self.commits)):
+            sha = fake_sha(repo, number)
+            self._numbers[sha] = number
+            date = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(1700000000 - number * 60))
+            author = {'name': f"Author {number % 7}", 'email': f"author{number % 7}@example.com", 'date': date}
+            items.append({
+                'sha': sha,
+                'node_id': f"C_{sha[:20]}",
+                'url': f"{self.url}/repos/{repo}/commits/{sha}",
+                'commit': {'message': f"Change handler {number}", 'author': author, 'committer': author}
+            })
+        return items
+
+    def detail(self, repo, sha):
+        number = self._numbers.get(sha, 0)
+        return {
+            'sha': sha,
+            'files': [
+                {
+                    'filename': f"src/module_{(number + f) % 50}.py",
+                    'patch': fake_patch(number),
+                    'raw_url': f"{self.url}/{repo}/raw/{sha}/src/module_{(number + f) % 50}.py"
+                }
+                for f in range(self.files_per_commit)
+            ]
+        }
+
+    def source(self, sha):
+        return fake_source(self._numbers.get(sha, 0))
+
+
+class _OllamaHandler(_Handler):
+    def do_POST(self):
+        ollama = self.owner
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        path = self.path.rstrip('/')
+        options = request.get('options') or {}
+        if path == '/api/generate':
+            ollama.load(request.get('model'), options.get('num_ctx'))
+            return self.send_json(200, {'model': request.get('model'), 'response': '', 'done': True})
+        if path != '/api/chat':
+            return self.send_json(404, {'error': 'not found'})
+        prompt = ''.join(message.get('content', '') for message in request.get('messages', []))
+        tokens = ollama.answer(options.get('num_predict'))
+        with ollama.slots:  # the server runs OLLAMA_NUM_PARALLEL requests at a time
+            ollama.load(request.get('model'), options.get('num_ctx'))
+            with ollama.lock:
+                ollama.requests += 1
+            if request.get('stream', True):
+                return self.stream(request, tokens, prompt)
+            time.sleep(ollama.token_delay * len(tokens))
+        self.send_json(200, self.chunk(request, ''.join(tokens), prompt, tokens))
+
+    def chunk(self, request, content, prompt=None, tokens=None):
+        chunk = {
+            'model': request.get('model'),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'message': {'role': 'assistant', 'content': content},
+            'done': tokens is not None
+        }
+        if tokens is not None:
+            seconds = self.owner.token_delay * len(tokens)
+            chunk.update(total_duration=int(seconds * 1e9), prompt_eval_count=len(prompt) // 4,
+                         eval_count=len(tokens), eval_duration=int(seconds * 1e9))
+        return chunk
+
+    def stream(self, request, tokens, prompt):
+        """One NDJSON line a token like Ollama, stopping when the client goes away"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for token in tokens:
+                time.sleep(self.owner.token_delay)
+                self.write_chunk(self.chunk(request, token))
+            self.write_chunk(self.chunk(request, '', prompt, tokens))
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            with self.owner.lock:
+                self.owner.cancelled += 1
+            self.close_connection = True
+
+    def write_chunk(self, body):
+        data = json.dumps(body).encode() + b'\n'
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b'\r\n')
+        self.wfile.flush()
+
+
+class FakeOllama(_Server):
+    """
+    /api/chat answering a fixed summary, streamed a token at a time or whole,
+    `parallel` requests at a time. Generating the summary takes `delay`
+    seconds, after which the model goes on with `trailing` whitespace tokens
+    up to num_predict, as llama3 can in JSON mode. Loading a model, or
+    reloading it for another num_ctx, takes `load_delay`; /api/generate with
+    an empty prompt only loads.
+    """
+    handler = _OllamaHandler
+
+    def __init__(self, delay=0.05, parallel=4, trailing=0, load_delay=0.0):
+        super().__init__()
+        self.delay = delay
+        self.parallel = parallel
+        self.trailing = trailing
+        self.load_delay = load_delay
+        self.requests = 0
+        self.loads = 0
+        self.cancelled = 0
+        self.lock = threading.Lock()
+        self.slots = threading.Semaphore(parallel)
+        self._loading = threading.Lock()
+        self._loaded = {}
+        content = json.dumps({'Summary': 'Changes the handlers to step through the values.', 'Importance': 2})
+        self._tokens = [content[i:i + 4] for i in range(0, len(content), 4)]
+        self.token_delay = delay / len(self._tokens)
+
+    def answer(self, num_predict=None):
+        tokens = self._tokens + [' '] * self.trailing
+        return tokens[:num_predict] if num_predict else tokens
+
+    def load(self, model, num_ctx=None):
+        with self._loading:
+            if self._loaded.get(model, 'unloaded') != num_ctx:
+                time.sleep(self.load_delay)
+                self._loaded[model] = num_ctx
+                self.loads += 1
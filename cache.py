@@ -0,0 +1,266 @@
+import functools
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+from metrics import shared_metrics
+
+_COMMIT_URL_RE = re.compile(r'/repos/([^/]+/[^/]+)/commits/([0-9a-fA-F]{7,40})')
+
+
+class SQLiteLRUCache:
+    """
+    Compressed JSON values in a SQLite table, evicted least recently used first
+    once the stored values grow past `max_bytes`.
+    """
+
+    def __init__(self, path, max_bytes=1024 ** 3, table='entries', metrics=None):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.max_bytes = max_bytes
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            f'CREATE TABLE IF NOT EXISTS {table} '
+            '(key TEXT PRIMARY KEY, value BLOB, size INTEGER, accessed REAL)'
+        )
+        self._db.execute(f'CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed)')
+        self.size = self._db.execute(f'SELECT COALESCE(SUM(size), 0) FROM {table}').fetchone()[0]
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute(f'SELECT value FROM {self.table} WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                self._count('miss')
+                return None
+            self.hits += 1
+            self._count('hit')
+            with self._db:
+                self._db.execute(f'UPDATE {self.table} SET accessed = ? WHERE key = ?', (time.time(), key))
+        return json.loads(zlib.decompress(row[0]))
+
+    def _count(self, result):
+        if self.metrics is not None:
+            self.metrics.inc('cache_lookups_total', cache=self.table, result=result)
+
+    def put(self, key, value):
+        blob = zlib.compress(json.dumps(value).encode())
+        with self._lock, self._db:
+            old = self._db.execute(f'SELECT size FROM {self.table} WHERE key = ?', (key,)).fetchone()
+            self._db.execute(
+                f'INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?)', (key, blob, len(blob), time.time())
+            )
+            self.size += len(blob) - (old[0] if old else 0)
+            self._evict()
+        if self.metrics is not None:
+            self.metrics.set('cache_bytes', self.size, cache=self.table)
+
+    def delete(self, key):
+        with self._lock, self._db:
+            old = self._db.execute(f'SELECT size FROM {self.table} WHERE key = ?', (key,)).fetchone()
+            if old:
+                self._db.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+                self.size -= old[0]
+
+    def _evict(self):
+        while self.size > self.max_bytes:
+            rows = self._db.execute(
+                f'SELECT key, size FROM {self.table} ORDER BY accessed LIMIT 100'
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self.size <= self.max_bytes:
+                    break
+                self._db.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+                self.size -= size
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'bytes': self.size}
+
+    def close(self):
+        self._db.close()
+
+
+def commit_key(url):
+    """'owner/repo@sha' for a commit detail url, None if the url doesn't name a commit"""
+    match = _COMMIT_URL_RE.search(url or '')
+    if match is None:
+        return None
+    return f"{match.group(1).lower()}@{match.group(2).lower()}"
+
+
+class CommitCache(SQLiteLRUCache):
+    """
+    Commit detail payloads keyed by repository and SHA, and the functions
+    resolved from the files at the commit next to them. Neither changes for a
+    SHA, so entries don't expire and only leave through eviction.
+    """
+
+    def __init__(self, path='.cache/commits.sqlite', max_bytes=1024 ** 3, metrics=None):
+        super().__init__(path, max_bytes, table='commits', metrics=metrics)
+
+    def get_commit(self, url):
+        key = commit_key(url)
+        return self.get(key) if key else None
+
+    def put_commit(self, url, detail):
+        key = commit_key(url)
+        if key:
+            self.put(key, detail)
+
+    def get_functions(self, url, version):
+        """The changed functions resolved for the files of a commit, by filename"""
+        key = commit_key(url)
+        return self.get(f"{key}|functions|{version}") if key else None
+
+    def put_functions(self, url, version, functions):
+        key = commit_key(url)
+        if key:
+            self.put(f"{key}|functions|{version}", functions)
+
+
+class SummaryCache(SQLiteLRUCache):
+    """
+    LLM summaries keyed by commit, model and prompt version. A summary only
+    goes stale when the model or the prompt changes, so there is no expiry;
+    drop_stale removes what other models and prompt versions left behind.
+    """
+
+    def __init__(self, path='.cache/summaries.sqlite', max_bytes=256 * 1024 ** 2, metrics=None):
+        super().__init__(path, max_bytes, table='summaries', metrics=metrics)
+
+    @staticmethod
+    def summary_key(url, model, prompt_version):
+        key = commit_key(url)
+        return f"{key}|{model}|{prompt_version}" if key else None
+
+    def get_summary(self, url, model, prompt_version):
+        key = self.summary_key(url, model, prompt_version)
+        return self.get(key) if key else None
+
+    def put_summary(self, url, model, prompt_version, summary):
+        key = self.summary_key(url, model, prompt_version)
+        if key:
+            self.put(key, summary)
+
+    def drop_stale(self, models, prompt_version):
+        """
+        Delete the summaries of every other model and prompt version, returns
+        how many went. `models` is one model name or a list of the ones in use.
+        """
+        models = [models] if isinstance(models, str) else [model for model in models if model]
+        keep = ' AND '.join(['key NOT LIKE ?'] * len(models))
+        with self._lock, self._db:
+            deleted = self._db.execute(
+                f'DELETE FROM {self.table} WHERE {keep}', [f"%|{model}|{prompt_version}" for model in models]
+            ).rowcount
+            self.size = self._db.execute(f'SELECT COALESCE(SUM(size), 0) FROM {self.table}').fetchone()[0]
+        return deleted
+
+
+class RecordStore(SQLiteLRUCache):
+    """
+    Full commit records, files and patches included, keyed by repository and
+    SHA so tasks can hand each other CommitRefs instead of the records. The
+    store holds the only copy of a record in flight, so the records this
+    process wrote are never evicted, however large a backfill grows; a run
+    releases its records once they are ingested. Eviction only clears what
+    runs that never got to release theirs left behind.
+    """
+
+    def __init__(self, path='.cache/records.sqlite', max_bytes=2 * 1024 ** 3, metrics=None):
+        super().__init__(path, max_bytes, table='records', metrics=metrics)
+        self._pinned = set()
+
+    def put_record(self, record):
+        """Store a record and return the CommitRef standing in for it"""
+        ref = CommitRef.from_record(record)
+        with self._lock:
+            self._pinned.add(ref.key)
+        self.put(ref.key, record)
+        return ref
+
+    def load(self, ref):
+        """The full record of a ref, with its summary when it has one"""
+        record = self.get(ref.key)
+        if record is None:
+            raise KeyError(f"Commit {ref.key} is no longer in the record store")
+        if ref.summary is not None:
+            record['summary'] = ref.summary
+        return record
+
+    def release(self, refs):
+        """Delete the records of refs once nothing loads them anymore"""
+        for ref in refs:
+            self.delete(ref.key)
+            with self._lock:
+                self._pinned.discard(ref.key)
+
+    def _evict(self):
+        if self.size <= self.max_bytes:
+            return
+        size = self.size
+        evicted = []
+        for key, entry_size in self._db.execute(f'SELECT key, size FROM {self.table} ORDER BY accessed'):
+            if size <= self.max_bytes:
+                break
+            if key not in self._pinned:
+                evicted.append((key,))
+                size -= entry_size
+        self._db.executemany(f'DELETE FROM {self.table} WHERE key = ?', evicted)
+        self.size = size
+
+
+class CommitRef:
+    """
+    What the tasks pass around for a commit: the store key and the metadata
+    needed for logging and sync marks. The files and patches stay in the
+    RecordStore until a stage loads them.
+    """
+    __slots__ = ('key', 'url', 'id', 'message', 'date', 'summary')
+
+    def __init__(self, key, url, id, message, date, summary=None):
+        self.key = key
+        self.url = url
+        self.id = id
+        self.message = message
+        self.date = date
+        self.summary = summary
+
+    @classmethod
+    def from_record(cls, record):
+        url = record['url']
+        return cls(commit_key(url) or url, url, record['id'], record['commit_message'], record['date'],
+                   record.get('summary'))
+
+    @property
+    def sha(self):
+        return self.url.rsplit('/', 1)[-1]
+
+    def __repr__(self):
+        return f"CommitRef({self.key!r})"
+
+
+@functools.lru_cache(maxsize=None)
+def shared_commit_cache(path='.cache/commits.sqlite'):
+    return CommitCache(path, metrics=shared_metrics())
+
+
+@functools.lru_cache(maxsize=None)
+def shared_summary_cache(path='.cache/summaries.sqlite'):
+    return SummaryCache(path, metrics=shared_metrics())
+
+
+@functools.lru_cache(maxsize=None)
+def shared_record_store(path='.cache/records.sqlite'):
+    return RecordStore(path, metrics=shared_metrics())
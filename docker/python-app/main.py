@@ -3,6 +3,8 @@ import httpx
 import ollama
 import os
 
+from github_api import commit_record, fetch_commit_details, make_async_client
+
 
 @task
 def get_repo_commits(url):
@@ -27,48 +29,27 @@ def get_repo_commits(url):
 
 
 @task
-async def get_commit_info(data):
+async def get_commit_info(data, concurrency=10):
     result_list = []
     logger = get_run_logger()
-    for commit in data:
-        try:
-            commit_message = commit.get('commit', {}).get('message', 'NONE')
-            author = commit.get('commit', {}).get('author', {})
-            date = commit.get('commit', {}).get('author', {}).get('date', 'NONE')
-            url = commit.get('url', 'NONE')
-            async with httpx.AsyncClient() as client:
-                files_commit = await client.get(url)
-                files_commit.raise_for_status()
-                files_data = files_commit.json()
-
-            files = []
-            for file in files_data.get('files', []):
-                filename = file.get('filename', 'NONE')
-                patch = file.get('patch', 'NONE')
-                raw_url = file.get('raw_url', 'NONE')
-
-                files.append({
-                    "filename": filename,
-                    "patch": patch,
-                    "raw_url": raw_url
-                })
-
-            result_list.append({
-                "commit_message": commit_message,
-                "author": author,
-                "date": date,
-                "url": url,
-                "files": files
-            })
-            logger.info(f"Successfully processed commit {commit_message} at {url}")
-        except httpx.HTTPStatusError:
+    urls = [commit.get('url', 'NONE') for commit in data]
+    # one pooled client for every commit, closed once the details are in
+    async with make_async_client(max_connections=concurrency) as client:
+        details = await fetch_commit_details(urls, client=client, concurrency=concurrency)
+    for commit, files_data in zip(data, details):
+        url = commit.get('url', 'NONE')
+        if files_data is None:
             print(f"HTTP error occurred while getting data from {url}")
             logger.error(f"HTTP error occurred while getting data from {url}")
             continue  # Continue with the next iteration
+        try:
+            record = commit_record(commit, files_data)
         except Exception as e:
             print(f"An error occurred: {e}")
             logger.error(f"An error occurred: {e}")
             continue  # Continue with the next iteration
+        result_list.append(record)
+        logger.info(f"Successfully processed commit {record['commit_message']} at {url}")
     return result_list
 
 
@@ -0,0 +1,191 @@
+import ast
+import re
+
+_HUNK_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@ ?(.*)$')
+
+# Part of the key resolved functions are cached under, bump it when the same patch and source resolve differently
+RESOLVER_VERSION = 3
+
+# function and class definitions of the common languages, in hunk headers and changed lines
+_DEFINITION_RES = [
+    re.compile(r'^\s*(?:async\s+)?def\s+(?:self\.)?([A-Za-z_]\w*[?!]?)'),  # Python, Ruby
+    re.compile(r'^\s*class\s+([A-Za-z_$][\w$]*)'),  # Python, JavaScript, Java, C#, Ruby
+    re.compile(r'^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*([A-Za-z_$][\w$]*)'),  # JavaScript
+    re.compile(r'^\s*func\s+(?:\([^)]*\)\s*)?([A-Za-z_]\w*)'),  # Go
+    re.compile(r'^\s*(?:pub(?:\([^)]*\))?\s+)?(?:async\s+)?fn\s+([A-Za-z_]\w*)'),  # Rust
+]
+
+
+def parse_hunks(patch):
+    """
+    The hunks of a unified diff as (old_start, new_start, context, removed, added):
+    `context` is the text after the second @@, usually the enclosing definition,
+    `added` the (new line number, text) of the added lines and `removed` the
+    (new line number, text) of the removed ones, numbered by the new line
+    they were removed before.
+    """
+    hunks = []
+    hunk = None
+    old = new = 0
+    for line in (patch or '').splitlines():
+        match = _HUNK_RE.match(line)
+        if match:
+            old, new = int(match.group(1)), int(match.group(3))
+            hunk = (old, new, match.group(5), [], [])
+            hunks.append(hunk)
+        elif hunk is None:
+            continue
+        elif line.startswith('-'):
+            hunk[3].append((new, line[1:]))
+            old += 1
+        elif line.startswith('+'):
+            hunk[4].append((new, line[1:]))
+            new += 1
+        elif not line.startswith('\\'):  # "\ No newline at end of file"
+            old += 1
+            new += 1
+    return hunks
+
+
+def definition_name(line):
+    for regex in _DEFINITION_RES:
+        match = regex.match(line)
+        if match:
+            return match.group(1)
+    return None
+
+
+def _unique(names):
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def hunk_functions(patch):
+    """
+    Functions a patch changes going by the patch alone: a changed line
+    belongs to the last definition above it, on a changed or context line
+    of its hunk or else the one git names in the hunk header. Blank lines
+    belong to nothing, and decorators to the definition below them. Works
+    for any language the definition patterns know, but misses a function
+    whose definition line is outside the hunk and not in its header.
+    """
+    names = []
+    current = None
+    decorators = 0  # changed decorator lines waiting for the definition they belong to
+    for line in (patch or '').splitlines():
+        match = _HUNK_RE.match(line)
+        if match:
+            current = definition_name(match.group(5))
+            decorators = 0
+            continue
+        text = line[1:]
+        name = definition_name(text)
+        if name:
+            current = name
+            decorators = 0
+        if not line.startswith(('+', '-')) or not text.strip():
+            continue
+        if text.lstrip().startswith('@'):
+            decorators += 1
+            continue
+        names.extend([current] * (decorators + 1))
+        decorators = 0
+    if decorators:
+        names.append(current)
+    return _unique(names)
+
+
+def python_spans(source):
+    """(qualified name, first line, last line) of every function and class in Python source"""
+    spans = []
+
+    def visit(node, prefix):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                name = f"{prefix}{child.name}"
+                start = min([child.lineno] + [decorator.lineno for decorator in child.decorator_list])
+                spans.append((name, start, child.end_lineno))
+                visit(child, f"{name}.")
+            else:
+                visit(child, prefix)
+
+    visit(ast.parse(source), '')
+    return spans
+
+
+def _innermost(spans, line):
+    best = None
+    for name, start, end in spans:
+        if start <= line <= end and (best is None or start >= best[1]):
+            best = (name, start, end)
+    return best[0] if best else None
+
+
+def _surviving_removals(removed):
+    """
+    The removed lines of a hunk that belonged to code still in the file:
+    not blank, and not part of a definition the hunk deletes, its
+    decorators included.
+    """
+    kept = []
+    decorators = []
+    deleted = None  # (new line number, indentation) of a removed definition line
+    for line, text in removed:
+        if not text.strip():
+            continue
+        indent = len(text) - len(text.lstrip())
+        if deleted is not None and line == deleted[0] and indent > deleted[1]:
+            continue  # the body of the deleted definition
+        deleted = None
+        if definition_name(text):
+            deleted = (line, indent)
+            decorators = []
+        elif text.lstrip().startswith('@'):
+            decorators.append((line, text))
+        else:
+            kept.extend(decorators)
+            kept.append((line, text))
+            decorators = []
+    return kept + decorators
+
+
+def python_functions(patch, source):
+    """
+    Functions and classes a patch to a Python file changes, by mapping its
+    changed lines onto the spans `ast` finds in the file after the change.
+    Whole definitions the patch deletes are taken from the removed lines.
+    Like the names found from the patch alone, a method is named without its
+    class, Function nodes are merged on the bare name.
+    """
+    spans = python_spans(source)
+    remaining = {name.rsplit('.', 1)[-1] for name, _, _ in spans}
+    names = []
+    for _, _, _, removed, added in parse_hunks(patch):
+        names.extend(_innermost(spans, line) for line, _ in added)
+        # a replaced line belongs with its replacement, a deleted one with the line before the gap it left
+        replaced = {line for line, _ in added}
+        names.extend(_innermost(spans, line if line in replaced else max(line - 1, 1))
+                     for line, _ in _surviving_removals(removed))
+        deleted = (definition_name(text) for _, text in removed)
+        names.extend(name for name in deleted if name not in remaining)
+    return _unique(name.rsplit('.', 1)[-1] for name in names if name)
+
+
+def changed_functions(filename, patch, source=None):
+    """
+    The functions a file's patch changes. Python files with their source are
+    resolved with `ast`, everything else (or source that doesn't parse) from
+    the patch alone.
+    """
+    if not patch or patch == 'NONE':
+        return []
+    if source is not None and filename.endswith('.py'):
+        try:
+            return python_functions(patch, source)
+        except (SyntaxError, ValueError):
+            pass
+    return hunk_functions(patch)
+
+
+def commit_functions(files):
+    """All the functions the files of a commit record change, in file order"""
+    return _unique(name for file in files for name in file.get('functions') or [])
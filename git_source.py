@@ -0,0 +1,201 @@
+import codecs
+import os
+import subprocess
+from datetime import datetime
+from urllib.parse import quote
+
+from functions import changed_functions
+from github_api import GITHUB_API_URL, MAX_SOURCE_BYTES
+
+# fields of the header git log prints for every commit, the body can span lines
+_RECORD = '\x1e'
+_FIELD = '\x1f'
+_LOG_FORMAT = f'{_RECORD}%H{_FIELD}%P{_FIELD}%an{_FIELD}%ae{_FIELD}%aI{_FIELD}%B{_FIELD}'
+_HEADER_FIELDS = 6
+
+
+def mirror_path(repo, root='.cache/mirrors'):
+    return os.path.join(root, f"{repo}.git")
+
+
+def update_mirror(repo, root='.cache/mirrors', remote_url=None):
+    """
+    Clone a bare mirror of a repository, or fetch what is new when it already
+    exists. Returns the path of the mirror.
+    """
+    path = mirror_path(repo, root)
+    if os.path.isdir(path):
+        subprocess.run(['git', '-C', path, 'fetch', '--prune', '--quiet', 'origin'], check=True)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        remote_url = remote_url or f"https://github.com/{repo}.git"
+        subprocess.run(['git', 'clone', '--mirror', '--quiet', remote_url, path], check=True)
+    return path
+
+
+def _path(text):
+    """A path as a diff header prints it, unquoted when git quoted it"""
+    text = text.rstrip('\n')
+    if len(text) > 1 and text.startswith('"') and text.endswith('"'):
+        # C style quoting, of paths with control characters, quotes or backslashes
+        return codecs.escape_decode(text[1:-1].encode())[0].decode(errors='replace')
+    # the ---/+++ lines end a path that has spaces with a tab
+    return text.rstrip('\t')
+
+
+def _filename(diff_header):
+    """The new path of a `diff --git a/<old> b/<new>` line"""
+    paths = diff_header[len('diff --git '):].rstrip('\n')
+    if paths.endswith('"'):
+        return _path(paths[paths.rindex(' "') + 1:])[2:]
+    # the two paths are the same unless the file was renamed, and then the rename lines name it;
+    # splitting at the middle keeps a path with ' b/' in it whole
+    middle = len(paths) // 2
+    if paths[2:middle] == paths[middle + 3:]:
+        return paths[middle + 3:]
+    return paths.rsplit(' b/', 1)[-1]
+
+
+def _record(repo, header, files):
+    sha, parents, name, email, date, message = header.split(_FIELD)[:_HEADER_FIELDS]
+    return {
+        "commit_message": message.strip('\n'),
+        "author": {"name": name, "email": email, "date": date},
+        "date": date,
+        "url": f"{GITHUB_API_URL}/repos/{repo}/commits/{sha}",
+        # the GitHub node id can't be derived from the clone; the graph keys commits on their sha
+        "id": sha,
+        "parents": parents.split(),
+        "files": files
+    }
+
+
+def _file(filename, patch_lines, sha, repo):
+    # like GitHub, the patch starts at the first hunk and binary files have none
+    patch = ''.join(patch_lines).rstrip('\n') if patch_lines else 'NONE'
+    return {
+        "filename": filename,
+        "patch": patch,
+        "raw_url": f"https://github.com/{repo}/raw/{sha}/{quote(filename)}",
+        "functions": changed_functions(filename, patch)
+    }
+
+
+class BlobReader:
+    """Reads files at any commit of a repository through one long running `git cat-file --batch`"""
+
+    def __init__(self, path):
+        self._process = subprocess.Popen(['git', '-C', path, 'cat-file', '--batch'], stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE)
+
+    def read(self, sha, filename):
+        """The text of `filename` at `sha`, None when it doesn't exist there, is binary or too large"""
+        self._process.stdin.write(f"{sha}:{filename}\n".encode())
+        self._process.stdin.flush()
+        header = self._process.stdout.readline().split()
+        if len(header) != 3:  # "<object> missing" or "<object> ambiguous"
+            return None
+        size = int(header[2])
+        data = self._process.stdout.read(size + 1)[:size]  # the content is followed by a newline
+        if header[1] != b'blob' or size > MAX_SOURCE_BYTES:
+            return None
+        try:
+            return data.decode()
+        except UnicodeDecodeError:
+            return None
+
+    def close(self):
+        self._process.stdin.close()
+        self._process.wait()
+
+
+def resolve_functions(record, blobs):
+    """Map the patches of the Python files of a record onto the functions `ast` finds in the files at the commit"""
+    sha = record['id']
+    for file in record['files']:
+        if file['filename'].endswith('.py') and file['patch'] != 'NONE':
+            source = blobs.read(sha, file['filename'])
+            if source is not None:
+                file['functions'] = changed_functions(file['filename'], file['patch'], source)
+    return record
+
+
+def parse_log(lines, repo):
+    """Turn the lines of `git log -p` in _LOG_FORMAT into commit records, one at a time"""
+    header = None
+    files = []
+    filename = None
+    patch = None
+
+    def finish_file():
+        if filename is not None:
+            files.append(_file(filename, patch, header.split(_FIELD, 1)[0], repo))
+
+    for line in lines:
+        if line.startswith(_RECORD):
+            if header is not None:
+                finish_file()
+                yield _record(repo, header, files)
+            header, files, filename, patch = line[1:], [], None, None
+        elif header is not None and header.count(_FIELD) < _HEADER_FIELDS:
+            header += line  # the rest of a multi line commit message
+        elif line.startswith('diff --git '):
+            finish_file()
+            filename, patch = _filename(line), None
+        elif patch is not None:
+            patch.append(line)
+        elif line.startswith('@@'):
+            patch = [line]
+        elif line.startswith('rename to '):
+            filename = _path(line[len('rename to '):])
+        elif line.startswith('+++ ') and _path(line[4:]).startswith('b/'):
+            filename = _path(line[4:])[2:]
+    if header is not None:
+        finish_file()
+        yield _record(repo, header, files)
+
+
+def _timestamp(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def iter_commit_batches(path, repo, rev='HEAD', since=None, until=None, stop_at_sha=None, max_commits=None,
+                        batch_size=100, resolve_sources=True):
+    """
+    Yield the records get_commit_info builds, newest first in lists of
+    `batch_size`, read from a local mirror with a single streaming git log.
+    Merge commits are diffed against their first parent as GitHub does.
+    Stops before `stop_at_sha`. With `resolve_sources` the changed functions
+    of Python files are resolved against the files at the commit.
+    """
+    # paths as they are rather than with every non-ASCII byte escaped
+    command = ['git', '-C', path, '-c', 'core.quotePath=false', 'log', '--no-color', '--no-ext-diff', '-p',
+               '--diff-merges=first-parent', f'--format={_LOG_FORMAT}']
+    if since:
+        command.append(f'--since={_timestamp(since)}')
+    if until:
+        command.append(f'--until={_timestamp(until)}')
+    if max_commits:
+        command.append(f'--max-count={max_commits}')
+    command += [rev, '--']
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, encoding='utf-8', errors='replace')
+    blobs = BlobReader(path) if resolve_sources else None
+    batch = []
+    try:
+        for record in parse_log(process.stdout, repo):
+            if stop_at_sha and record['url'].endswith(f"/{stop_at_sha}"):
+                break
+            if blobs is not None:
+                resolve_functions(record, blobs)
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+        if blobs is not None:
+            blobs.close()
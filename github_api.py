@@ -0,0 +1,455 @@
+import asyncio
+import functools
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime
+
+import httpx
+from dotenv import load_dotenv
+
+from cache import SQLiteLRUCache, commit_key
+from functions import RESOLVER_VERSION, changed_functions
+from metrics import shared_metrics
+
+GITHUB_API_URL = 'https://api.github.com'
+# Python files larger than this keep the functions found from their patch
+MAX_SOURCE_BYTES = 1024 ** 2
+
+_LINK_RE = re.compile(r'<([^>]+)>\s*;\s*rel="([^"]+)"')
+
+
+def github_headers():
+    load_dotenv('.env', override=True)
+    token = os.getenv('GITHUB_API_KEY')
+    return {'Authorization': f'Bearer {token}'}
+
+
+def parse_link_header(header):
+    """Map each rel of a GitHub Link header to its url"""
+    return {rel: link for link, rel in _LINK_RE.findall(header or '')}
+
+
+def _commit_list_params(per_page=None, since=None, until=None, sha=None):
+    params = {}
+    if per_page:
+        params['per_page'] = per_page
+    for key, value in (('since', since), ('until', until)):
+        if value:
+            params[key] = value.isoformat() if isinstance(value, datetime) else value
+    if sha:
+        params['sha'] = sha
+    return params
+
+
+def repo_name(url):
+    """'owner/repo' of a GitHub API repository url"""
+    match = re.search(r'/repos/([^/]+/[^/]+)', url)
+    return match.group(1).lower() if match else url
+
+
+def known_commit_index(page, stop_at_sha):
+    """Position of `stop_at_sha` in a page of the listing, None if it isn't there"""
+    if not stop_at_sha:
+        return None
+    return next((i for i, commit in enumerate(page) if commit.get('sha') == stop_at_sha), None)
+
+
+def iter_commit_pages(url, headers=None, per_page=100, since=None, until=None, sha=None, max_pages=None,
+                      client=None, scheduler=None, stop_at_sha=None):
+    """
+    Yield the commit listing of a repository one page at a time, following the
+    Link rel="next" headers. Only the current page is held in memory. Listing
+    stops before `stop_at_sha`, the newest commit an earlier run already has.
+    """
+    # an empty dict would clear a query string already present on the url
+    params = _commit_list_params(per_page, since, until, sha) or None
+    owns_client = client is None
+    if owns_client:
+        client = httpx.Client(headers=headers or github_headers(), timeout=30)
+    pages = 0
+    try:
+        while url:
+            if scheduler is None:
+                response = client.get(url, params=params)
+                response.raise_for_status()  # Raises an HTTPError if the response status is 4xx, 5xx
+                page, link = response.json(), response.headers.get('link')
+            else:
+                page, link = _send_scheduled(client, scheduler, url, params)
+            known = known_commit_index(page, stop_at_sha)
+            if known is not None:
+                if known:
+                    yield page[:known]
+                break
+            yield page
+            pages += 1
+            if max_pages and pages >= max_pages:
+                break
+            url = parse_link_header(link).get('next')
+            params = None  # the next link already carries the query string
+    finally:
+        if owns_client:
+            client.close()
+
+
+def _send_scheduled(client, scheduler, url, params=None):
+    request = client.build_request('GET', url, params=params)
+    key = str(request.url)
+    while True:
+        scheduler.wait_sync()
+        request.headers.update(scheduler.request_headers(key))
+        response = client.send(request)
+        scheduler.observe(response)
+        if not scheduler.is_rate_limited(response):
+            return scheduler.resolve(key, response)
+
+
+def make_async_client(headers=None, max_connections=20, http2=True, timeout=30):
+    """One connection pooled client to share between all concurrent GitHub requests"""
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    return httpx.AsyncClient(headers=headers or github_headers(), http2=http2, limits=limits, timeout=timeout)
+
+
+def commit_files(files_data):
+    """Shape the files of a commit detail payload the way the rest of the flow expects them"""
+    files = []
+    for file in files_data.get('files', []):
+        files.append({
+            "filename": file.get('filename', 'NONE'),
+            "patch": file.get('patch', 'NONE'),
+            "raw_url": file.get('raw_url', 'NONE'),
+            "functions": changed_functions(file.get('filename', 'NONE'), file.get('patch'))
+        })
+    return files
+
+
+def is_merge(commit):
+    """Whether a listing item or commit record has more than one parent"""
+    return len(commit.get('parents') or []) > 1
+
+
+def needs_detail(commit, skip_merges=False):
+    """
+    False for listing items whose detail request can be skipped: the ones
+    known to change no files and, with `skip_merges`, merge commits. Triage
+    summarizes a merge from its message, its first parent diff repeats the
+    commits it merges.
+    """
+    if skip_merges and is_merge(commit):
+        return False
+    return (commit.get('stats') or {}).get('changed_files') != 0
+
+
+def commit_record(commit, files_data):
+    """The record the flow works with for a commit of the listing and its detail payload"""
+    info = commit.get('commit', {})
+    return {
+        "commit_message": info.get('message', 'NONE'),
+        "author": info.get('author', {}),
+        "date": info.get('author', {}).get('date', 'NONE'),
+        "url": commit.get('url', 'NONE'),
+        "id": commit.get('node_id', 'NONE'),
+        "parents": [parent.get('sha') for parent in commit.get('parents') or []],
+        "files": commit_files(files_data) if files_data else []
+    }
+
+
+def _backoff_delay(attempt, backoff):
+    # exponential backoff with jitter so concurrent retries don't hit the API in lockstep
+    return backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+
+async def fetch_json(client, url, retries=3, backoff=0.5, scheduler=None):
+    """
+    GET a url and return its JSON body, retrying 5xx responses and transport
+    errors. With a scheduler the request is paced against the rate limit and
+    made conditional on the stored ETag.
+    """
+    attempt = 0
+    while True:
+        headers = {}
+        if scheduler is not None:
+            await scheduler.wait()
+            headers = scheduler.request_headers(url)
+        try:
+            response = await client.get(url, headers=headers)
+        except httpx.TransportError:
+            if attempt >= retries:
+                raise
+        else:
+            if scheduler is not None:
+                scheduler.observe(response)
+                if scheduler.is_rate_limited(response):
+                    continue  # the scheduler holds the next request back until the limit lifts
+                if response.status_code < 500 or attempt >= retries:
+                    return scheduler.resolve(url, response)[0]
+            elif response.status_code < 500 or attempt >= retries:
+                response.raise_for_status()  # Raises an HTTPError if the response status is 4xx, 5xx
+                return response.json()
+        await asyncio.sleep(_backoff_delay(attempt, backoff))
+        attempt += 1
+
+
+async def fetch_commit_detail(client, url, retries=3, backoff=0.5, scheduler=None, cache=None, semaphore=None):
+    """The detail payload of one commit from the cache or the API, None if the fetch failed"""
+    if cache is not None:
+        detail = cache.get_commit(url)
+        if detail is not None:
+            return detail
+    try:
+        if semaphore is None:
+            detail = await fetch_json(client, url, retries, backoff, scheduler)
+        else:
+            async with semaphore:
+                detail = await fetch_json(client, url, retries, backoff, scheduler)
+    except httpx.HTTPError as e:
+        print(f"HTTP error occurred while getting data from {url}: {e}")
+        return None
+    if cache is not None:
+        cache.put_commit(url, detail)
+    return detail
+
+
+async def fetch_commit_details(urls, client=None, concurrency=10, retries=3, backoff=0.5, scheduler=None,
+                               cache=None):
+    """
+    Fetch many commit detail urls at once with at most `concurrency` requests in
+    flight. Results come back in the order of `urls`, None where a fetch failed.
+    With a CommitCache, cached payloads skip the network and fetched ones are
+    written back.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(url):
+        return await fetch_commit_detail(client, url, retries, backoff, scheduler, cache, semaphore)
+
+    if client is not None:
+        return await asyncio.gather(*(fetch(url) for url in urls))
+    async with make_async_client(max_connections=concurrency) as client:
+        return await asyncio.gather(*(fetch(url) for url in urls))
+
+
+async def fetch_source(client, url, scheduler=None):
+    """
+    The text of a file from its raw_url, None when it is missing, binary or
+    too large. The raw file host has a limit of its own, the scheduler paces
+    and counts it as the 'raw' resource.
+    """
+    try:
+        if scheduler is not None:
+            await scheduler.wait('raw')
+        response = await client.get(url, follow_redirects=True)
+        if scheduler is not None:
+            scheduler.observe(response, 'raw')
+        response.raise_for_status()
+    except httpx.HTTPError:
+        return None
+    if len(response.content) > MAX_SOURCE_BYTES:
+        return None
+    try:
+        return response.content.decode()
+    except UnicodeDecodeError:
+        return None
+
+
+async def resolve_functions(records, client=None, concurrency=10, scheduler=None, cache=None, semaphore=None):
+    """
+    Map the patches of the Python files of commit records onto the functions
+    `ast` finds in the files at the commit, fetched from their raw_url. The
+    other files, and the ones that can't be fetched, keep the functions found
+    from the patch alone. The raw file host doesn't count against the API quota.
+
+    With a CommitCache the functions of a commit are resolved once, commits
+    whose files were all fetched are stored and later runs make no request.
+    Pass a `semaphore` to share one limit of requests in flight between calls.
+    """
+    semaphore = semaphore or asyncio.Semaphore(concurrency)
+
+    async def resolve(file):
+        async with semaphore:
+            source = await fetch_source(client, file['raw_url'], scheduler)
+        if source is None:
+            return False
+        file['functions'] = changed_functions(file['filename'], file['patch'], source)
+        return True
+
+    async def resolve_record(record):
+        files = [file for file in record['files']
+                 if file['filename'].endswith('.py') and file.get('patch') not in (None, 'NONE')
+                 and file.get('raw_url', 'NONE') != 'NONE']
+        if not files:
+            return
+        cached = cache.get_functions(record['url'], RESOLVER_VERSION) if cache is not None else None
+        if cached is not None:
+            for file in files:
+                file['functions'] = cached.get(file['filename'], file['functions'])
+            return
+        resolved = await asyncio.gather(*(resolve(file) for file in files))
+        if cache is not None and all(resolved):
+            functions = {file['filename']: file['functions'] for file in files}
+            cache.put_functions(record['url'], RESOLVER_VERSION, functions)
+
+    if client is not None:
+        await asyncio.gather(*(resolve_record(record) for record in records))
+    else:
+        async with make_async_client(max_connections=concurrency) as client:
+            await asyncio.gather(*(resolve_record(record) for record in records))
+    return records
+
+
+class ETagStore(SQLiteLRUCache):
+    """
+    Validators and bodies of earlier GitHub responses, kept in SQLite so that
+    later runs can send conditional requests. GitHub doesn't charge quota for a
+    304 response, the stored body is reused instead. Commit detail payloads
+    aren't kept: their SHA never changes, so the CommitCache answers for them
+    without any request, and once it has evicted one a 304 would have no body
+    to go with it.
+    """
+
+    def __init__(self, path='.cache/github_etags.sqlite', max_bytes=64 * 1024 ** 2, metrics=None):
+        super().__init__(path, max_bytes, table='etags', metrics=metrics)
+        with self._lock, self._db:
+            # earlier versions kept every response body in this table, without a size limit
+            self._db.execute('DROP TABLE IF EXISTS responses')
+
+    def headers(self, url):
+        entry = self.get(url)
+        if entry is None:
+            return {}
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put_response(self, url, response, body):
+        etag = response.headers.get('etag')
+        last_modified = response.headers.get('last-modified')
+        if (not etag and not last_modified) or commit_key(url):
+            return
+        self.put(url, {'etag': etag, 'last_modified': last_modified, 'link': response.headers.get('link'),
+                       'body': body})
+
+    def cached(self, url):
+        """The body and Link header stored for url"""
+        entry = self.get(url)
+        if entry is None:
+            return None, None
+        return entry['body'], entry['link']
+
+
+class Quota:
+    """The budget of one GitHub rate limit resource"""
+    __slots__ = ('remaining', 'reset_at', 'blocked_until', 'next_slot')
+
+    def __init__(self):
+        self.remaining = None
+        self.reset_at = None
+        self.blocked_until = 0.0
+        self.next_slot = 0.0
+
+
+class RateLimitScheduler:
+    """
+    Paces GitHub requests against the quota reported by the API. One scheduler
+    is shared by every concurrent fetch so they all see the same budget.
+
+    Once fewer than `reserve` requests are left the remaining ones are spread
+    evenly until the window resets, and a Retry-After or an exhausted quota
+    holds every request back until the given time. GitHub keeps a separate
+    quota per resource, x-ratelimit-resource names it ('core' for REST,
+    'graphql' for the points based GraphQL quota), and each is paced on its own.
+    """
+
+    def __init__(self, etags=None, reserve=100, metrics=None):
+        self.etags = etags
+        self.reserve = reserve
+        self.metrics = metrics
+        self.quotas = {}
+        self.not_modified = 0
+        self._lock = threading.Lock()
+
+    def _quota(self, resource):
+        quota = self.quotas.get(resource)
+        if quota is None:
+            quota = self.quotas[resource] = Quota()
+        return quota
+
+    @property
+    def remaining(self):
+        """Requests left of the REST quota, None before the first response"""
+        return self._quota('core').remaining
+
+    def observe(self, response, resource='core'):
+        """Update the budget of the resource a response reports, `resource` when it names none"""
+        headers = response.headers
+        resource = headers.get('x-ratelimit-resource', resource)
+        if self.metrics is not None:
+            self.metrics.inc('github_requests_total', status=response.status_code, resource=resource)
+            self.metrics.observe('github_request_seconds', response.elapsed.total_seconds())
+            if 'x-ratelimit-remaining' in headers:
+                self.metrics.set('github_rate_limit_remaining', int(headers['x-ratelimit-remaining']),
+                                 resource=resource)
+        with self._lock:
+            quota = self._quota(resource)
+            if 'x-ratelimit-remaining' in headers:
+                quota.remaining = int(headers['x-ratelimit-remaining'])
+            if 'x-ratelimit-reset' in headers:
+                quota.reset_at = float(headers['x-ratelimit-reset'])
+            retry_after = headers.get('retry-after')
+            if retry_after:
+                delay = int(retry_after) if retry_after.isdigit() else 60
+                quota.blocked_until = max(quota.blocked_until, time.time() + delay)
+            elif quota.remaining == 0 and quota.reset_at:
+                quota.blocked_until = max(quota.blocked_until, quota.reset_at)
+
+    def is_rate_limited(self, response):
+        return response.status_code in (403, 429) and (
+            'retry-after' in response.headers or response.headers.get('x-ratelimit-remaining') == '0'
+        )
+
+    def _reserve_slot(self, resource):
+        """Claim the next request slot of a resource and return how long to sleep before using it"""
+        with self._lock:
+            quota = self._quota(resource)
+            now = time.time()
+            start = max(now, quota.blocked_until, quota.next_slot)
+            interval = 0.0
+            if quota.remaining is not None and quota.reset_at and quota.remaining < self.reserve:
+                interval = max(quota.reset_at - start, 0) / max(quota.remaining, 1)
+                # count the request we are about to make against the budget
+                quota.remaining = max(quota.remaining - 1, 0)
+            quota.next_slot = start + interval
+            return start - now
+
+    async def wait(self, resource='core'):
+        await asyncio.sleep(self._reserve_slot(resource))
+
+    def wait_sync(self, resource='core'):
+        time.sleep(self._reserve_slot(resource))
+
+    def request_headers(self, url):
+        return self.etags.headers(url) if self.etags is not None else {}
+
+    def resolve(self, url, response):
+        """Return the body and Link header of a response, from the ETag store if it was a 304"""
+        if response.status_code == 304 and self.etags is not None:
+            self.not_modified += 1
+            if self.metrics is not None:
+                self.metrics.inc('github_not_modified_total')
+            return self.etags.cached(url)
+        response.raise_for_status()  # Raises an HTTPError if the response status is 4xx, 5xx
+        body = response.json()
+        if self.etags is not None:
+            self.etags.put_response(url, response, body)
+        return body, response.headers.get('link')
+
+
+@functools.lru_cache(maxsize=None)
+def shared_scheduler(etag_path='.cache/github_etags.sqlite'):
+    """The scheduler every GitHub request of this process goes through"""
+    return RateLimitScheduler(ETagStore(etag_path, metrics=shared_metrics()), metrics=shared_metrics())
@@ -0,0 +1,127 @@
+from datetime import datetime
+
+import httpx
+
+from github_api import GITHUB_API_URL, github_headers, known_commit_index, repo_name
+
+GRAPHQL_URL = f'{GITHUB_API_URL}/graphql'
+
+history_query = """
+query($owner: String!, $name: String!, $expression: String!, $first: Int!, $after: String,
+      $since: GitTimestamp, $until: GitTimestamp) {
+  repository(owner: $owner, name: $name) {
+    object(expression: $expression) {
+      ... on Commit {
+        history(first: $first, after: $after, since: $since, until: $until) {
+          pageInfo { hasNextPage endCursor }
+          nodes {
+            oid
+            id
+            message
+            additions
+            deletions
+            changedFilesIfAvailable
+            parents(first: 2) { nodes { oid } }
+            author { name email date }
+            committer { name email date }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+
+class GitHubGraphQLError(Exception):
+    pass
+
+
+def _timestamp(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def listing_item(node, repo):
+    """A history node in the shape of an item of the REST /commits listing"""
+    return {
+        'sha': node['oid'],
+        'node_id': node['id'],
+        'url': f"{GITHUB_API_URL}/repos/{repo}/commits/{node['oid']}",
+        'parents': [{'sha': parent['oid']} for parent in (node.get('parents') or {}).get('nodes', [])],
+        'commit': {
+            'message': node.get('message', 'NONE'),
+            'author': node.get('author') or {},
+            'committer': node.get('committer') or {}
+        },
+        'stats': {
+            'additions': node.get('additions'),
+            'deletions': node.get('deletions'),
+            'changed_files': node.get('changedFilesIfAvailable')
+        }
+    }
+
+
+def post_graphql(client, query, variables, scheduler=None):
+    while True:
+        if scheduler is not None:
+            scheduler.wait_sync('graphql')
+        response = client.post(GRAPHQL_URL, json={'query': query, 'variables': variables})
+        if scheduler is not None:
+            # the points based GraphQL quota, apart from the one REST requests draw on
+            scheduler.observe(response, 'graphql')
+            if scheduler.is_rate_limited(response):
+                continue  # the scheduler holds the next request back until the limit lifts
+        response.raise_for_status()  # Raises an HTTPError if the response status is 4xx, 5xx
+        body = response.json()
+        if body.get('errors'):
+            raise GitHubGraphQLError(body['errors'])
+        return body['data']
+
+
+def iter_history_pages(url, headers=None, per_page=100, since=None, until=None, sha=None, max_pages=None,
+                       client=None, scheduler=None, stop_at_sha=None):
+    """
+    Drop-in for iter_commit_pages that pages through the GraphQL history
+    connection, up to 100 commits per request. Items have the shape of the
+    REST listing, their url points at the REST commit detail, which is still
+    where the changed files and patches come from because GraphQL doesn't
+    expose diffs. So this only saves listing requests, every commit still
+    costs one detail request; besides the commits that change no files, only
+    merges can go without one (skip_merge_details).
+    """
+    repo = repo_name(url)
+    owner, name = repo.split('/', 1)
+    variables = {
+        'owner': owner,
+        'name': name,
+        'expression': sha or 'HEAD',
+        'first': min(per_page or 100, 100),
+        'after': None,
+        'since': _timestamp(since),
+        'until': _timestamp(until)
+    }
+    owns_client = client is None
+    if owns_client:
+        client = httpx.Client(headers=headers or github_headers(), timeout=30)
+    pages = 0
+    try:
+        while True:
+            data = post_graphql(client, history_query, variables, scheduler)
+            target = (data.get('repository') or {}).get('object')
+            if not target:
+                raise GitHubGraphQLError(f"No commit history for {repo} at {variables['expression']}")
+            history = target['history']
+            page = [listing_item(node, repo) for node in history['nodes']]
+            known = known_commit_index(page, stop_at_sha)
+            if known is not None:
+                if known:
+                    yield page[:known]
+                break
+            yield page
+            pages += 1
+            if not history['pageInfo']['hasNextPage'] or (max_pages and pages >= max_pages):
+                break
+            variables['after'] = history['pageInfo']['endCursor']
+    finally:
+        if owns_client:
+            client.close()
@@ -0,0 +1,298 @@
+import hashlib
+import os
+import random
+import time
+import zlib
+
+from neo4j import GraphDatabase
+from neo4j.exceptions import ServiceUnavailable, SessionExpired, TransientError
+
+from functions import commit_functions
+
+TRANSIENT_ERRORS = (TransientError, ServiceUnavailable, SessionExpired)
+
+# Patches larger than this are cut before they are stored, None keeps them whole
+MAX_PATCH_BYTES = 1024 ** 2
+
+# Commit, author, file and function nodes for a whole batch of {commit, summary}
+# rows. FOREACH keeps a commit without files from dropping its functions.
+# Functions found in the patches link to their files as well as the commit.
+# Patches are content addressed Patch nodes holding the compressed text, written
+# once per distinct hash; the AFFECTS_FILE relationship of every commit keeps
+# the hash of its patch, so File nodes stay small and the history stays whole.
+# Commits are keyed on their sha, which every source backend knows; the GitHub
+# node id only comes from the API.
+add_commit_batch_query = """
+UNWIND $patches AS patch
+MERGE (p:Patch {hash: patch.hash})
+ON CREATE SET
+    p.data = patch.data,
+    p.size = patch.size,
+    p.truncated = patch.truncated
+WITH count(p) AS patches
+UNWIND $batch AS row
+MERGE (c:Commit {sha: row.commit.sha})
+ON CREATE SET
+    c.id = row.commit.id,
+    c.message = row.commit.commit_message,
+    c.date = row.commit.date,
+    c.url = row.commit.url,
+    c.summary = row.summary.Summary,
+    c.importance = row.summary.Importance
+MERGE (a:Author {name: row.commit.author.name, email: row.commit.author.email})
+MERGE (c)-[:COMMITTED_BY]->(a)
+FOREACH (file IN coalesce(row.commit.files, []) |
+    MERGE (f:File {filename: file.filename})
+    SET f.raw_url = file.raw_url
+    MERGE (c)-[r:AFFECTS_FILE]->(f)
+    SET r.patch_hash = file.patch_hash
+    FOREACH (function IN file.functions |
+        MERGE (fn:Function {name: function})
+        MERGE (f)-[:CONTAINS_FUNCTION]->(fn)
+    )
+)
+FOREACH (function IN coalesce(row.summary.Functions, []) |
+    MERGE (fn:Function {name: function})
+    MERGE (c)-[:AFFECTS_FUNCTION]->(fn)
+)
+"""
+
+# Uniqueness constraints (with their backing indexes) and indexes on the keys
+# add_commit_batch_query MERGEs on, so each MERGE is an index seek instead of
+# a label scan. Author has no single unique key, a composite index covers it.
+schema_constraints = {
+    'commit_sha': 'CREATE CONSTRAINT commit_sha IF NOT EXISTS FOR (c:Commit) REQUIRE c.sha IS UNIQUE',
+    'commit_id': 'CREATE CONSTRAINT commit_id IF NOT EXISTS FOR (c:Commit) REQUIRE c.id IS UNIQUE',
+    'file_filename': 'CREATE CONSTRAINT file_filename IF NOT EXISTS FOR (f:File) REQUIRE f.filename IS UNIQUE',
+    'function_name': 'CREATE CONSTRAINT function_name IF NOT EXISTS FOR (fn:Function) REQUIRE fn.name IS UNIQUE',
+    'patch_hash': 'CREATE CONSTRAINT patch_hash IF NOT EXISTS FOR (p:Patch) REQUIRE p.hash IS UNIQUE',
+}
+
+# Drops the patches earlier versions kept on File nodes, a batch at a time
+drop_file_patches_query = """
+MATCH (f:File) WHERE f.patch IS NOT NULL
+CALL { WITH f REMOVE f.patch } IN TRANSACTIONS OF 10000 ROWS
+"""
+# Sets the sha of the Commit nodes earlier versions keyed on the node id alone.
+# Where both backends created a node for the same commit only one gets the sha,
+# so the commit_sha constraint holds.
+set_commit_shas_query = """
+MATCH (c:Commit) WHERE c.sha IS NULL AND c.url IS NOT NULL
+WITH last(split(c.url, '/')) AS sha, collect(c) AS commits
+WHERE NOT EXISTS { MATCH (:Commit {sha: sha}) }
+WITH sha, head(commits) AS c
+CALL { WITH c, sha SET c.sha = sha } IN TRANSACTIONS OF 10000 ROWS
+"""
+# Migrations ensure_schema has run on this database, so it runs each only once
+migrations_done_query = "MATCH (m:Migration) RETURN m.name AS name"
+record_migration_query = "MERGE (:Migration {name: $name})"
+schema_indexes = {
+    'author_name_email': 'CREATE INDEX author_name_email IF NOT EXISTS FOR (a:Author) ON (a.name, a.email)',
+}
+
+
+class Neo4jWriter:
+    """Runs statements against Neo4j, each write in its own explicit transaction"""
+
+    def __init__(self, uri, username, password, database=None):
+        self.driver = GraphDatabase.driver(uri, auth=(username, password))
+        self.database = database
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.getenv('NEO4J_URI'),
+            os.getenv('NEO4J_USERNAME'),
+            os.getenv('NEO4J_PASSWORD'),
+            database=os.getenv('NEO4J_DATABASE')
+        )
+
+    def write(self, query, params=None):
+        with self.driver.session(database=self.database) as session:
+            with session.begin_transaction() as tx:
+                tx.run(query, params or {}).consume()
+                tx.commit()
+
+    def query(self, query, params=None):
+        with self.driver.session(database=self.database) as session:
+            return [record.data() for record in session.run(query, params or {})]
+
+    def write_in_transactions(self, query, params=None):
+        """Run a CALL { ... } IN TRANSACTIONS write, which can't run in an explicit transaction"""
+        with self.driver.session(database=self.database) as session:
+            session.run(query, params or {}).consume()
+
+    def close(self):
+        self.driver.close()
+
+
+class RecordingGraph:
+    """Stand-in for Neo4jWriter that records every statement instead of running it"""
+
+    def __init__(self, results=None):
+        self.writes = []
+        self.queries = []
+        self.results = results or {}
+
+    def write(self, query, params=None):
+        self.writes.append((query, params))
+
+    def query(self, query, params=None):
+        self.queries.append((query, params))
+        return self.results.get(query, [])
+
+    def write_in_transactions(self, query, params=None):
+        self.writes.append((query, params))
+
+    def close(self):
+        pass
+
+
+def write_with_retry(graph, query, params, retries=3, backoff=0.5):
+    for attempt in range(retries + 1):
+        try:
+            return graph.write(query, params)
+        except TRANSIENT_ERRORS:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def patch_hash(patch):
+    return hashlib.sha256(patch.encode()).hexdigest()
+
+
+def compress_patch(patch, max_bytes=MAX_PATCH_BYTES):
+    """
+    The Patch node properties for a patch: its hash, the zlib compressed text
+    cut to `max_bytes`, the size of the whole text and whether it was cut.
+    """
+    data = patch.encode()
+    size = len(data)
+    truncated = max_bytes is not None and size > max_bytes
+    if truncated:
+        data = data[:max_bytes]
+    return {'hash': patch_hash(patch), 'data': zlib.compress(data), 'size': size, 'truncated': truncated}
+
+
+def decompress_patch(data):
+    """The text of a Patch node's data, a cut patch can end mid character"""
+    return zlib.decompress(data).decode(errors='replace')
+
+
+def graph_batch(batch, max_patch_bytes=MAX_PATCH_BYTES):
+    """
+    The parameters of add_commit_batch_query for {commit, summary} rows: the
+    rows with each file's patch replaced by its hash, and every distinct patch
+    of the batch once, compressed. The functions found in the patches replace
+    the ones of the summary, which only fills in when the patches named none.
+    """
+    patches = {}
+    rows = []
+    for row in batch:
+        files = []
+        for file in row['commit'].get('files') or []:
+            patch = file.get('patch')
+            digest = None
+            if patch and patch != 'NONE':
+                digest = patch_hash(patch)
+                if digest not in patches:
+                    patches[digest] = compress_patch(patch, max_patch_bytes)
+            files.append({'filename': file.get('filename'), 'raw_url': file.get('raw_url'), 'patch_hash': digest,
+                          'functions': file.get('functions') or []})
+        summary = row['summary']
+        functions = commit_functions(files)
+        if functions:
+            summary = {**summary, 'Functions': functions}
+        sha = row['commit']['url'].rsplit('/', 1)[-1]
+        rows.append({'commit': {**row['commit'], 'sha': sha, 'files': files}, 'summary': summary})
+    return {'batch': rows, 'patches': list(patches.values())}
+
+
+def ingest_commits(graph, rows, batch_size=100, retries=3, backoff=0.5, metrics=None,
+                   max_patch_bytes=MAX_PATCH_BYTES):
+    """
+    Ingest {commit, summary} rows `batch_size` at a time, one UNWIND statement
+    and one transaction per batch. A batch failing after its retries is
+    reported and skipped. Returns the number of commits ingested.
+    """
+    ingested = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            ingested += _ingest_batch(graph, batch, retries, backoff, metrics, max_patch_bytes)
+            batch = []
+    if batch:
+        ingested += _ingest_batch(graph, batch, retries, backoff, metrics, max_patch_bytes)
+    return ingested
+
+
+def _ingest_batch(graph, batch, retries, backoff, metrics=None, max_patch_bytes=MAX_PATCH_BYTES):
+    started = time.perf_counter()
+    params = graph_batch(batch, max_patch_bytes)
+    try:
+        write_with_retry(graph, add_commit_batch_query, params, retries, backoff)
+    except Exception as e:
+        print(f"Failed to ingest batch of {len(batch)} commits due to {e}")
+        if metrics is not None:
+            metrics.inc('neo4j_commits_total', len(batch), result='failed')
+        return 0
+    if metrics is not None:
+        metrics.observe('neo4j_batch_seconds', time.perf_counter() - started)
+        metrics.inc('neo4j_commits_total', len(batch), result='ingested')
+        metrics.inc('neo4j_patch_bytes_total', sum(patch['size'] for patch in params['patches']), kind='text')
+        metrics.inc('neo4j_patch_bytes_total', sum(len(patch['data']) for patch in params['patches']),
+                    kind='compressed')
+    return len(batch)
+
+
+# Data migrations ensure_schema runs once per database, before anything is ingested
+migrations = {
+    'commit_sha': set_commit_shas_query,
+}
+
+
+def ensure_schema(graph):
+    """
+    Create the constraints and indexes ingestion relies on and run the
+    migrations this database hasn't had yet. Safe to run on every flow run.
+    """
+    for statement in list(schema_constraints.values()) + list(schema_indexes.values()):
+        write_with_retry(graph, statement, None)
+    done = {row['name'] for row in graph.query(migrations_done_query)}
+    for name, statement in migrations.items():
+        if name not in done:
+            graph.write_in_transactions(statement)
+            write_with_retry(graph, record_migration_query, {'name': name})
+
+
+def verify_schema(graph):
+    """Return the names of the constraints and indexes that are missing from the database"""
+    constraints = {row['name'] for row in graph.query('SHOW CONSTRAINTS YIELD name')}
+    indexes = {row['name'] for row in graph.query('SHOW INDEXES YIELD name')}
+    missing = [name for name in schema_constraints if name not in constraints]
+    missing += [name for name in schema_indexes if name not in indexes]
+    return missing
+
+
+if __name__ == '__main__':
+    import sys
+
+    from dotenv import load_dotenv
+
+    load_dotenv('.env', override=True)
+    kg = Neo4jWriter.from_env()
+    try:
+        if sys.argv[1:] == ['drop-file-patches']:
+            kg.write_in_transactions(drop_file_patches_query)
+            print("Removed the patches stored on File nodes")
+            sys.exit(0)
+        if sys.argv[1:] == ['verify']:
+            missing = verify_schema(kg)
+            print(f"Missing constraints and indexes: {', '.join(missing)}" if missing else "Schema is complete")
+            sys.exit(1 if missing else 0)
+        ensure_schema(kg)
+        print("Schema is set up")
+    finally:
+        kg.close()
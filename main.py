@@ -1,35 +1,39 @@
-import pprint
+import asyncio
 from dotenv import load_dotenv
 from prefect import flow, task, get_run_logger
-from prefect.tasks import task_input_hash
-from datetime import timedelta
+from prefect.artifacts import create_markdown_artifact, create_table_artifact
+from prefect.runtime import flow_run
 import httpx
-import ollama
 import os
-from langchain_community.graphs import Neo4jGraph
-import json
-import re
-
-
-def parse_stringified_json(obj):
-    if isinstance(obj, dict):
-        for key, value in obj.items():
-            obj[key] = parse_stringified_json(value)
-    elif isinstance(obj, list):
-        return [parse_stringified_json(item) for item in obj]
-    elif isinstance(obj, str):
-        # Try to detect and parse stringified JSON
-        try:
-            # Use regex to detect if the string looks like a JSON object or array
-            if re.match(r'^\[.*\]$', obj.strip()) or re.match(r'^\{.*\}$', obj.strip()):
-                return parse_stringified_json(json.loads(obj))
-        except json.JSONDecodeError:
-            pass
-    return obj
+
+from cache import shared_commit_cache, shared_record_store, shared_summary_cache
+from github_api import (GITHUB_API_URL, commit_record, fetch_commit_details, iter_commit_pages, make_async_client,
+                        needs_detail, repo_name, resolve_functions, shared_scheduler)
+from git_source import iter_commit_batches, update_mirror
+from github_graphql import iter_history_pages
+from graph import Neo4jWriter, ensure_schema, ingest_commits
+from metrics import shared_metrics
+from pipeline import run_pipeline
+from prompts import PROMPT_VERSION, SMALL_SUMMARY_MODEL, SUMMARY_MODEL
+from summarize import Summarizer, ollama_parallelism, summarize_refs
+from summary_parser import SummaryParseError, parse_summary
+from sync_state import SyncState, listing_kwargs, listing_watermark, record_watermark
+
+# Where the commit listing comes from, every source yields pages shaped like the REST listing
+commit_sources = {
+    'rest': iter_commit_pages,
+    'graphql': iter_history_pages,
+}
 
 
 @task
-def get_repo_commits(url):
+def get_repo_commits(url, since=None, until=None, sha=None, per_page=None, max_pages=1, stop_at_sha=None,
+                     backend='rest'):
+    """
+    Get the commit listing of a repository. By default only the first page is
+    returned, pass max_pages=None to follow the pagination to the end.
+    backend='graphql' lists through the GraphQL history, 100 commits a request.
+    """
     load_dotenv('.env', override=True)
 
     token = os.getenv('GITHUB_API_KEY')
@@ -37,11 +41,17 @@ def get_repo_commits(url):
     headers = {'Authorization': f'Bearer {token}'}
     logger = get_run_logger()
 
+    scheduler = shared_scheduler()
+    metrics = shared_metrics()
+
     try:
-        logger.info(httpx.get('https://api.github.com/rate_limit', headers=headers).json())
-        response = httpx.get(url, headers=headers)
-        response.raise_for_status()  # Raises an HTTPError if the response status is 4xx, 5xx
-        data = response.json()
+        data = []
+        with metrics.timer('stage', stage='get_repo_commits'):
+            for page in commit_sources[backend](url, headers, per_page=per_page, since=since, until=until, sha=sha,
+                                          max_pages=max_pages, scheduler=scheduler, stop_at_sha=stop_at_sha):
+                data.extend(page)
+        metrics.inc('commits_total', len(data), stage='get_repo_commits')
+        logger.info(f"GitHub rate limit remaining: {scheduler.remaining}")
     except httpx.HTTPStatusError:
         print(f"HTTP error occurred in get_repo_commits from repo {url}")
         logger.error(f"HTTP error occurred while getting data from {url}")
@@ -55,70 +65,66 @@ def get_repo_commits(url):
 
 
 @task
-def extract_files(commit):
-    load_dotenv('.env', override=True)
-
-    token = os.getenv('GITHUB_API_KEY')
-
-    headers = {'Authorization': f'Bearer {token}'}
-    logger = get_run_logger()
-
-    files = []
-    url = commit.get('url', 'NONE')
-    try:
-        files_commit = httpx.get(url, headers=headers)
-        files_commit.raise_for_status()  # Raises an HTTPError if the response status is 4xx, 5xx
-        files_data = files_commit.json()
-
-        for file in files_data.get('files', []):
-            filename = file.get('filename', 'NONE')
-            patch = file.get('patch', 'NONE')
-            raw_url = file.get('raw_url', 'NONE')
-
-            files.append({
-                "filename": filename,
-                "patch": patch,
-                "raw_url": raw_url
-            })
-    except httpx.HTTPStatusError:
-        print(f"HTTP error occurred while getting data from {url}")
-        logger.error(f"HTTP error occurred while getting data from {url}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        logger.error(f"An error occurred: {e}")
-    return files
-
-
-@task
-def get_commit_info(data):
+def get_commit_info(data, concurrency=10, chunk_size=500, resolve_sources=True, skip_merge_details=False):
+    """
+    Build the commit records of a commit listing and keep them in the record
+    store, returning a CommitRef for each and None for the commits whose
+    details couldn't be fetched, so the caller knows they are missing. The
+    detail requests share one pooled client and run `concurrency` at a time,
+    `chunk_size` commits at a time so a large listing never has all its
+    patches in memory. With `resolve_sources` the changed functions of Python
+    files are resolved against the files at the commit. With
+    `skip_merge_details` merge commits get no detail request, triage
+    summarizes them from the message.
+    """
     result_list = []
     logger = get_run_logger()
-    for commit in data:
-        try:
-            commit_message = commit.get('commit', {}).get('message', 'NONE')
-            author = commit.get('commit', {}).get('author', {})
-            date = commit.get('commit', {}).get('author', {}).get('date', 'NONE')
+    load_dotenv('.env', override=True)
+    scheduler = shared_scheduler()
+    cache = shared_commit_cache()
+    store = shared_record_store()
+    metrics = shared_metrics()
+    for start in range(0, len(data), chunk_size):
+        chunk = data[start:start + chunk_size]
+        # commits the listing knows to change no files don't need a detail request
+        needed = [commit for commit in chunk if needs_detail(commit, skip_merge_details)]
+        with metrics.timer('stage', stage='get_commit_info'):
+            fetched = asyncio.run(fetch_commit_details([commit.get('url', 'NONE') for commit in needed],
+                                                       concurrency=concurrency, scheduler=scheduler, cache=cache))
+        metrics.inc('commits_total', sum(detail is not None for detail in fetched), stage='get_commit_info')
+        by_url = {commit.get('url', 'NONE'): detail for commit, detail in zip(needed, fetched)}
+        records = []
+        for commit in chunk:
             url = commit.get('url', 'NONE')
-            id = commit.get('node_id', 'NONE')
-            files = extract_files.submit(commit)
-
-            result_list.append({
-                "commit_message": commit_message,
-                "author": author,
-                "date": date,
-                "url": url,
-                "id": id,
-                "files": files.result()
-            })
-            logger.info(f"Successfully processed commit {commit_message} at {url}")
-        except httpx.HTTPStatusError:
-            print(f"HTTP error occurred while getting data from {url}")
-            logger.error(f"HTTP error occurred while getting data from {url}")
-            continue  # Continue with the next iteration
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            logger.error(f"An error occurred: {e}")
-            continue  # Continue with the next iteration
+            detail = by_url.get(url, {})
+            if detail is None:
+                # without its files the commit would be summarized and ingested as changing nothing
+                logger.error(f"Failed to get the details of commit {url}")
+                metrics.inc('commits_failed_total', stage='get_commit_info')
+                records.append(None)
+                continue
+            try:
+                records.append(commit_record(commit, detail))
+            except Exception as e:
+                print(f"An error occurred: {e}")
+                logger.error(f"An error occurred: {e}")
+                metrics.inc('commits_failed_total', stage='get_commit_info')
+                records.append(None)
+                continue  # Continue with the next iteration
+        if resolve_sources:
+            with metrics.timer('stage', stage='resolve_functions'):
+                asyncio.run(resolve_functions([record for record in records if record is not None],
+                                              concurrency=concurrency, scheduler=scheduler, cache=cache))
+        for record in records:
+            if record is None:
+                result_list.append(None)
+                continue
+            ref = store.put_record(record)
+            result_list.append(ref)
+            logger.info(f"Successfully processed commit {ref.message} at {ref.url}")
+    logger.info(f"GitHub rate limit remaining: {scheduler.remaining}, "
+                f"{scheduler.not_modified} responses served from ETags")
+    logger.info(f"Commit cache: {cache.hits} hits, {cache.misses} misses, {cache.size} bytes stored")
     return result_list
 
 
@@ -155,110 +161,331 @@ def get_commit_info(data):
 #             logger.error(f"An error occurred: {e}")
 #     return commits_with_summary
 
-@task(cache_key_fn=task_input_hash, cache_expiration=timedelta(hours=1))
-def get_repo_summary(commit):
+@task
+def get_mirror_commit_info(url, since=None, stop_at_sha=None, max_commits=None, batch_size=100):
+    """
+    Build the commit records of a repository from a local bare mirror, fetching
+    what is new into the mirror first, and keep them in the record store.
+    Returns a CommitRef for each. Needs no GitHub API requests.
+    """
     logger = get_run_logger()
-    logger.info(f"Getting summary for commit data - {commit['commit_message']}")
-    try:
-        response = ollama.chat(model="llama3", format='json', stream=False, messages=[
-            {
-                'role': 'user',
-                'content': f"""
-                Here is the commit data: {commit}
-                Analyze this commit from a GitHub repository. Summarize the main changes,
-                including the patch details. Identify the functions and files that were modified.
-                Assess the importance of this commit to the overall codebase on a scale from 1 to 5,
-                with 5 being the most crucial. Format the analysis in a compact JSON format without any new lines
-                or unnecessary spaces. Include keys 'Files', 'Functions', 'Summary', 'Importance'.
-                For each file, list the filename, its raw URL, and include the patch content.
-                Specify which functions were affected in each file. The JSON output should be compact
-                and readable in a single line if possible.
-                """
-            }
-        ])
-        try:
-            commit['summary'] = response['message']['content']
-            logger.info(f"Successfully received summary for commit data - {commit['commit_message']}")
-        except json.JSONDecodeError:
-            # Log and attempt to fix the JSON
-            logger.warning(f"Invalid JSON string, attempting to fix it.")
-            commit['summary'] = parse_stringified_json(response['message']['content'])
-            if commit['summary'] is None:
-                logger.error("Failed to fix the JSON string.")
-                raise
-        return commit
-    except Exception as e:
-        logger.error(f"An error occurred: {e}")
+    repo = repo_name(url)
+    path = update_mirror(repo)
+    store = shared_record_store()
+    result_list = []
+    for batch in iter_commit_batches(path, repo, since=since, stop_at_sha=stop_at_sha, max_commits=max_commits,
+                                     batch_size=batch_size):
+        result_list.extend(store.put_record(record) for record in batch)
+        logger.info(f"Read {len(result_list)} commits from the mirror of {repo}")
+    return result_list
+
+
+@task
+def get_repo_summary(ref, model=SUMMARY_MODEL):
+    """Summarize the commit behind a CommitRef, returns the ref with its summary set"""
+    logger = get_run_logger()
+    logger.info(f"Getting summary for commit data - {ref.message}")
+    metrics = shared_metrics()
+    with metrics.timer('stage', stage='get_repo_summary'):
+        ref = asyncio.run(summarize_refs([ref], shared_record_store(), model, concurrency=1,
+                                         cache=shared_summary_cache(), metrics=metrics))[0]
+    if ref is None:
+        logger.error("Failed to get a summary for the commit")
         return None
+    logger.info(f"Successfully received summary for commit data - {ref.message}")
+    return ref
+
+
+@task
+def get_repo_summaries(commits, model=SUMMARY_MODEL, concurrency=None):
+    """
+    Summarize a list of CommitRefs with several requests in flight at once,
+    by default as many as the Ollama server runs in parallel.
+    """
+    logger = get_run_logger()
+    cache = shared_summary_cache()
+    metrics = shared_metrics()
+    concurrency = concurrency or ollama_parallelism()
+    logger.info(f"Summarizing {len(commits)} commits, {concurrency} at a time")
+    with metrics.timer('stage', stage='get_repo_summaries'):
+        summaries = asyncio.run(summarize_refs(commits, shared_record_store(), model, concurrency=concurrency,
+                                               cache=cache, metrics=metrics))
+    metrics.inc('commits_total', sum(commit is not None for commit in summaries), stage='get_repo_summaries')
+    logger.info(f"Summarized {sum(commit is not None for commit in summaries)} of {len(commits)} commits")
+    return summaries
 
 
 @flow(log_prints=True, retries=3, retry_delay_seconds=10)
-def get_repo_info(url):
+def get_repo_info(url, batch_size=100, incremental=False, summary_concurrency=None, backend='rest', max_pages=1,
+                  skip_merge_details=False):
     """
-    Given a GitHub repository, get the number of commits and the commit info
+    Given a GitHub repository, get the number of commits and the commit info.
+    With incremental=True only commits newer than the last synced one are processed.
+    backend is 'rest', 'graphql' or 'git' to read from a local mirror instead of the API.
+    Without a sync mark only max_pages pages of the listing are processed, None for all of them.
+    With skip_merge_details merge commits cost no detail request and are summarized from their message.
     """
     logger = get_run_logger()
     load_dotenv('.env', override=True)
-    commits = get_repo_commits(url)
-    commit_info = get_commit_info(commits)
-
-    commits_with_summary = []
-
-    for commit in commit_info:
-        commit_w_summary = get_repo_summary.submit(commit)
-        commits_with_summary.append(commit_w_summary.result())
-
-    kg = Neo4jGraph(
-        url=os.getenv('NEO4J_URI'),
-        username=os.getenv('NEO4J_USERNAME'),
-        password=os.getenv('NEO4J_PASSWORD'),
-        database=os.getenv('NEO4J_DATABASE')
-    )
-
-    add_commit_node_query = """
-MERGE (c:Commit {id: $commit.id})
-ON CREATE SET
-    c.message = $commit.commit_message,
-    c.date = $commit.date,
-    c.url = $commit.url,
-    c.summary = $summary.Summary,
-    c.importance = $summary.Importance
-MERGE (a:Author {name: $commit.author.name, email: $commit.author.email})
-MERGE (c)-[:COMMITTED_BY]->(a)
-WITH c, a, $summary.Functions AS functions, $commit.files AS files
-UNWIND files AS file
-MERGE (f:File {filename: file.filename})
-SET f.patch = file.patch,
-    f.raw_url = file.raw_url
-MERGE (c)-[:AFFECTS_FILE]->(f)
-WITH c, functions
-UNWIND functions AS function
-MERGE (fn:Function {name: function})
-MERGE (c)-[:AFFECTS_FUNCTION]->(fn)
-    """
+    metrics = shared_metrics()
+    repo = repo_name(url)
+    state = SyncState() if incremental else None
+    mark = state.get(repo) if state else None
+    if mark:
+        logger.info(f"Syncing {repo} since {mark['sha']} ({mark['date']})")
+    if backend == 'git':
+        # records come straight from the local mirror, no listing or detail requests
+        if mark:
+            commit_info = get_mirror_commit_info(url, since=mark['date'], stop_at_sha=mark['sha'])
+        else:
+            commit_info = get_mirror_commit_info(url, max_commits=30 * max_pages if max_pages else None)
+        newest = record_watermark(commit_info[0]) if commit_info else None
+        failed = []
+    else:
+        if mark:
+            commits = get_repo_commits(url, since=mark['date'], per_page=100, max_pages=None,
+                                       stop_at_sha=mark['sha'], backend=backend)
+        else:
+            commits = get_repo_commits(url, per_page=100 if max_pages != 1 else None, max_pages=max_pages,
+                                       backend=backend)
+        commit_info = get_commit_info(commits, skip_merge_details=skip_merge_details) if commits else []
+        newest = listing_watermark(commits[0]) if commits else None
+        # shas of the commits that failed on their own, counted in the sync state
+        failed = [commit.get('sha') for commit, ref in zip(commits, commit_info) if ref is None]
+    if not commit_info:
+        logger.info(f"No new commits for {repo}")
+        publish_metrics()
+        return
+    fetched = [ref for ref in commit_info if ref is not None]
+    if len(fetched) < len(commit_info):
+        logger.warning(f"Failed to get the details of {len(commit_info) - len(fetched)} commits")
 
-    for commit in commits_with_summary:
-        summary = commit['summary']
-        try:
-            # First attempt to parse with json.loads
-            summary_dict = json.loads(summary)
-        except json.JSONDecodeError:
-            # If that fails, attempt to parse with parse_stringified_json
-            summary_dict = parse_stringified_json(commit['summary'])
-            if not isinstance(summary_dict, dict):
-                logger.error(f"Failed to parse summary for commit {commit['id']}: {summary_dict}")
-                pprint.pprint(commit['summary'])
-                continue
-        pprint.pprint(summary_dict)
+    summary_cache = shared_summary_cache()
+    dropped = summary_cache.drop_stale([SUMMARY_MODEL, SMALL_SUMMARY_MODEL], PROMPT_VERSION)
+    if dropped:
+        logger.info(f"Dropped {dropped} summaries of other models or prompt versions")
+
+    commits_with_summary = get_repo_summaries(fetched, concurrency=summary_concurrency)
+    logger.info(f"Summary cache: {summary_cache.hits} hits, {summary_cache.misses} misses")
+    failed += [ref.sha for ref, summarized in zip(fetched, commits_with_summary) if summarized is None]
+
+    parsed = []
+    for ref in commits_with_summary:
+        if ref is None:
+            continue
         try:
-            logger.info(f"Ingesting commit {commit['id']}")
-            kg.query(add_commit_node_query, params={"commit": commit, "summary": summary_dict})
-        except Exception as e:
-            print(f"Failed to ingest commit {commit['id']} due to {e}")
+            parsed.append((ref, parse_summary(ref.summary).as_dict()))
+        except SummaryParseError as e:
+            logger.error(f"Failed to parse summary for commit {ref.id}: {e}")
+            metrics.inc('summary_parse_errors_total')
+            failed.append(ref.sha)
+
+    store = shared_record_store()
+
+    def rows():
+        # records are loaded from the store as ingest_commits fills each batch, not all at once
+        for ref, summary in parsed:
+            try:
+                yield {"commit": store.load(ref), "summary": summary}
+            except KeyError as e:
+                logger.error(f"An error occurred: {e}")
+                metrics.inc('commits_failed_total', stage='ingest')
+
+    kg = Neo4jWriter.from_env()
+    try:
+        ensure_schema(kg)
+        logger.info(f"Ingesting {len(parsed)} commits in batches of {batch_size}")
+        with metrics.timer('stage', stage='ingest'):
+            ingested = ingest_commits(kg, rows(), batch_size=batch_size, metrics=metrics)
+        logger.info(f"Ingested {ingested} of {len(parsed)} commits")
+    finally:
+        kg.close()
+        store.release(fetched)
+    publish_metrics()
+
+    if state is not None and not state.settle(repo, newest, len(commit_info), ingested, failed):
+        # keep the old mark so the commits that failed are picked up again
+        logger.warning(f"Only {ingested} of {len(commit_info)} commits ingested, not advancing the sync mark")
+
+
+@flow(log_prints=True, retries=3, retry_delay_seconds=10)
+def stream_repo_info(url, batch_size=100, incremental=False, max_pages=None, fetch_concurrency=10,
+                     summary_concurrency=None, queue_size=50, backend='rest', skip_merge_details=False):
+    """
+    Pipelined get_repo_info. Listing, detail fetching, summarizing and ingest
+    run at the same time joined by bounded queues, so the first commits reach
+    Neo4j within seconds and memory depends on queue_size, not on the repository.
+    """
+    if backend not in commit_sources:
+        raise ValueError(f"stream_repo_info lists commits through the API, backend must be one of "
+                         f"{', '.join(commit_sources)}")
+    logger = get_run_logger()
+    load_dotenv('.env', override=True)
+    repo = repo_name(url)
+    state = SyncState() if incremental else None
+    mark = state.get(repo) if state else None
+    if mark:
+        logger.info(f"Syncing {repo} since {mark['sha']} ({mark['date']})")
+
+    summary_cache = shared_summary_cache()
+    summary_cache.drop_stale([SUMMARY_MODEL, SMALL_SUMMARY_MODEL], PROMPT_VERSION)
+
+    kg = Neo4jWriter.from_env()
+    try:
+        ensure_schema(kg)
+        stats = asyncio.run(run_pipeline(
+            url, kg, listing_kwargs(mark, max_pages), fetch_concurrency=fetch_concurrency,
+            summary_concurrency=summary_concurrency, queue_size=queue_size, batch_size=batch_size,
+            scheduler=shared_scheduler(), commit_cache=shared_commit_cache(), summary_cache=summary_cache,
+            lister=commit_sources[backend], metrics=shared_metrics(), skip_merge_details=skip_merge_details
+        ))
+    finally:
+        kg.close()
+    publish_metrics()
+    logger.info(f"Listed {stats['listed']}, fetched {stats['fetched']}, summarized {stats['summarized']}, "
+                f"ingested {stats['ingested']} commits of {repo} in {stats['seconds']:.1f}s, "
+                f"{stats['failed']} failed, first ingest after {stats['first_ingest_seconds']}s")
+
+    if state is not None and stats['newest'] is not None and not state.advance(repo, stats):
+        logger.warning(f"{stats['failed']} commits failed, not advancing the sync mark")
+    return stats
+
+
+def publish_metrics(key='pipeline-metrics'):
+    """
+    Attach the metrics of this process to the flow run, as a table and as
+    Prometheus text, and write them to $METRICS_FILE when it is set.
+    """
+    metrics = shared_metrics()
+    create_table_artifact(key=key, table=metrics.table(),
+                          description="Stage latencies, request counts, cache hits, GitHub quota and LLM tokens")
+    create_markdown_artifact(key=f"{key}-prometheus", markdown=f"```\n{metrics.to_prometheus()}```",
+                             description="The same metrics in the Prometheus text format")
+    path = os.getenv('METRICS_FILE')
+    if path:
+        metrics.write(path)
+
+
+def read_repo_list(path):
+    """Repositories from a file, one 'owner/repo' or API url per line, # starts a comment"""
+    with open(path) as f:
+        return [line.split('#', 1)[0].strip() for line in f if line.split('#', 1)[0].strip()]
+
+
+def repo_commits_url(repo):
+    return repo if repo.startswith('http') else f"{GITHUB_API_URL}/repos/{repo}/commits"
+
+
+def repo_sync_flow(graph, client, summarizer, state=None, retries=2, retry_delay=10, **pipeline_kwargs):
+    """
+    The subflow get_many_repo_info runs for every repository. Flow parameters
+    have to be JSON serializable, so the graph writer, the HTTP client, the
+    Summarizer and the sync state shared between repositories are closed
+    over instead of passed.
+    """
+    @flow(name='sync-repo', flow_run_name='sync-{repo}', log_prints=True, retries=retries,
+          retry_delay_seconds=retry_delay)
+    async def sync_repo(repo, url, backend='rest', max_pages=None):
+        """
+        The streaming pipeline for one repository, from its sync mark on.
+        Raises when the pipeline stopped with an error, so Prefect retries
+        the repository on its own.
+        """
+        mark = state.get(repo) if state is not None else None
+        stats = await run_pipeline(
+            url, graph, listing_kwargs(mark, max_pages), scheduler=shared_scheduler(),
+            commit_cache=shared_commit_cache(), lister=commit_sources[backend], client=client, summarizer=summarizer,
+            metrics=shared_metrics(), **pipeline_kwargs
+        )
+        if stats['error']:
+            raise RuntimeError(f"Syncing {repo} failed: {stats['error']}")
+        if state is not None:
+            state.advance(repo, stats)
+        stats['attempts'] = flow_run.run_count
+        return stats
+
+    return sync_repo
+
+
+@flow(log_prints=True)
+async def get_many_repo_info(repos=None, repos_file=None, max_concurrent_repos=4, incremental=True, max_pages=None,
+                             batch_size=100, fetch_concurrency=10, summary_concurrency=None, queue_size=50,
+                             retries=2, retry_delay=10, backend='rest', skip_merge_details=False):
+    """
+    Run the streaming pipeline for a list of repositories, given directly or
+    as a file, at most max_concurrent_repos at a time. Every repository is a
+    sync-repo subflow that fails and retries on its own; the GitHub client,
+    the Summarizer (so the LLM concurrency limit is global) and Neo4j are
+    shared. Ends with a report of what every repository did.
+    """
+    if backend not in commit_sources:
+        raise ValueError(f"get_many_repo_info lists commits through the API, backend must be one of "
+                         f"{', '.join(commit_sources)}")
+    logger = get_run_logger()
+    load_dotenv('.env', override=True)
+    urls = [repo_commits_url(repo) for repo in (repos or []) + (read_repo_list(repos_file) if repos_file else [])]
+    logger.info(f"Syncing {len(urls)} repositories, {max_concurrent_repos} at a time")
+
+    summary_cache = shared_summary_cache()
+    summary_cache.drop_stale([SUMMARY_MODEL, SMALL_SUMMARY_MODEL], PROMPT_VERSION)
+    summarizer = Summarizer(SUMMARY_MODEL, summary_concurrency, cache=summary_cache, metrics=shared_metrics())
+    state = SyncState() if incremental else None
+    semaphore = asyncio.Semaphore(max_concurrent_repos)
+
+    async def run(sync, url):
+        repo = repo_name(url)
+        async with semaphore:
+            run_state = await sync(repo, url, backend, max_pages, return_state=True)
+        if run_state.is_completed():
+            stats = await run_state.result(fetch=True)
+        else:
+            stats = {'listed': 0, 'ingested': 0, 'failed': 1, 'seconds': None, 'attempts': retries + 1,
+                     'error': run_state.message or run_state.name}
+        stats['repo'] = repo
+        return stats
+
+    kg = Neo4jWriter.from_env()
+    try:
+        await asyncio.to_thread(ensure_schema, kg)
+        async with make_async_client(max_connections=fetch_concurrency * max_concurrent_repos) as client:
+            sync = repo_sync_flow(kg, client, summarizer, state, retries, retry_delay,
+                                  fetch_concurrency=fetch_concurrency, queue_size=queue_size, batch_size=batch_size,
+                                  skip_merge_details=skip_merge_details)
+            report = await asyncio.gather(*(run(sync, url) for url in urls))
+    finally:
+        kg.close()
+    await asyncio.to_thread(publish_metrics)
+
+    rows = []
+    for stats in report:
+        seconds = stats['seconds'] or 0
+        rows.append({
+            'repo': stats['repo'],
+            'listed': stats['listed'],
+            'ingested': stats['ingested'],
+            'failed': stats['failed'],
+            'attempts': stats['attempts'],
+            'seconds': round(seconds, 1),
+            'commits_per_second': round(stats['ingested'] / seconds, 2) if seconds else 0,
+            'error': stats['error'] or ''
+        })
+        logger.info(f"{stats['repo']}: {rows[-1]}")
+    await create_table_artifact(key='repo-sync-report', table=rows,
+                                description=f"Commits synced for {len(rows)} repositories")
+    failed = [row['repo'] for row in rows if row['error']]
+    if failed:
+        logger.error(f"{len(failed)} repositories failed: {', '.join(failed)}")
+    return rows
 
 
 if __name__ == '__main__':
-    get_repo_info("https://api.github.com/repos/PrefectHQ/prefect/commits")
+    import sys
+
+    if len(sys.argv) > 1:
+        # python main.py repos.txt
+        asyncio.run(get_many_repo_info(repos_file=sys.argv[1]))
+    else:
+        get_repo_info("https://api.github.com/repos/PrefectHQ/prefect/commits")
     # get_repo_info.serve(
     #     name="repo-tryout",
     #     tags=["testing", "tutorial"],
@@ -0,0 +1,168 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds in seconds, from a cached lookup to a slow LLM request
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class _Histogram:
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket the q-th observation falls in, the largest bound past the last one"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.bounds[-1]
+
+
+def _label_text(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms keyed by name and labels, safe to update
+    from the flow's threads and tasks at once. Values accumulate for the life
+    of the process, like a Prometheus client's, and are exported as
+    Prometheus text or JSON.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe how long the block takes in `name`, counting a raised exception in `{name}_errors_total`"""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(f"{name}_errors_total", **labels)
+            raise
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - started, **labels)
+
+    def value(self, name, **labels):
+        """The current value of a counter or gauge, 0 when nothing was recorded"""
+        key = self._key(name, labels)
+        with self._lock:
+            return self.counters.get(key, self.gauges.get(key, 0))
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                'gauges': [{'name': name, 'labels': dict(labels), 'value': value}
+                           for (name, labels), value in sorted(self.gauges.items())],
+                'histograms': [{'name': name, 'labels': dict(labels), 'count': h.count, 'sum': h.sum,
+                                'p50': h.quantile(0.5), 'p99': h.quantile(0.99),
+                                'buckets': dict(zip([*map(str, h.bounds), '+Inf'], h.counts))}
+                               for (name, labels), h in sorted(self.histograms.items())]
+            }
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=2)
+
+    def to_prometheus(self):
+        """The metrics in the Prometheus text exposition format"""
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                declare(name, 'counter')
+                lines.append(f"{name}{_label_text(labels)} {value}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                declare(name, 'gauge')
+                lines.append(f"{name}{_label_text(labels)} {value}")
+            for (name, labels), h in sorted(self.histograms.items()):
+                declare(name, 'histogram')
+                cumulative = 0
+                for bound, count in zip([*map(str, h.bounds), '+Inf'], h.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_label_text(labels, ('le', bound))} {cumulative}")
+                lines.append(f"{name}_sum{_label_text(labels)} {h.sum}")
+                lines.append(f"{name}_count{_label_text(labels)} {h.count}")
+        return '\n'.join(lines) + '\n'
+
+    def table(self):
+        """One row per series, for a Prefect table artifact"""
+        data = self.as_dict()
+        rows = []
+        for kind in ('counters', 'gauges'):
+            for series in data[kind]:
+                rows.append({'metric': series['name'], 'labels': _label_text(series['labels'].items()),
+                             'value': series['value'], 'p50': '', 'p99': ''})
+        for series in data['histograms']:
+            rows.append({'metric': series['name'], 'labels': _label_text(series['labels'].items()),
+                         'value': f"{series['count']} obs, mean {series['sum'] / series['count']:.4g}",
+                         'p50': series['p50'], 'p99': series['p99']})
+        return rows
+
+    def write(self, path):
+        """Write the metrics to `path`, as JSON when it ends in .json and Prometheus text otherwise"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(self.to_json() if path.endswith('.json') else self.to_prometheus())
+
+
+@functools.lru_cache(maxsize=None)
+def shared_metrics():
+    """The metrics every stage of this process records into"""
+    return Metrics()
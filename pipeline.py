@@ -0,0 +1,172 @@
+import asyncio
+import time
+from contextlib import nullcontext
+
+from github_api import (commit_record, fetch_commit_detail, iter_commit_pages, make_async_client, needs_detail,
+                        resolve_functions)
+from graph import ingest_commits
+from prompts import SUMMARY_MODEL
+from summarize import Summarizer, ollama_parallelism
+from summary_parser import SummaryParseError, parse_summary
+
+# end of stream marker, one is queued for every worker of the next stage
+_DONE = object()
+
+
+def _stage_timer(metrics, stage):
+    return metrics.timer('stage', stage=stage) if metrics is not None else nullcontext()
+
+
+async def _close_after(workers, queue, consumers):
+    await asyncio.gather(*workers)
+    for _ in range(consumers):
+        await queue.put(_DONE)
+
+
+async def run_pipeline(url, graph, list_kwargs=None, fetch_concurrency=10, summary_concurrency=None,
+                       queue_size=50, batch_size=100, flush_interval=2.0, scheduler=None, commit_cache=None,
+                       summary_cache=None, model=SUMMARY_MODEL, ollama_host=None, lister=iter_commit_pages,
+                       client=None, summarizer=None, metrics=None, resolve_sources=True, skip_merge_details=False):
+    """
+    List, fetch details, summarize and ingest the commits of a repository as
+    concurrent stages joined by bounded queues. A stage that falls behind
+    fills its input queue and blocks the stage feeding it, so memory is bound
+    by `queue_size` instead of the size of the repository.
+
+    Ingestion writes a batch when it has `batch_size` commits or when its
+    oldest commit has waited `flush_interval` seconds, so commits reach the
+    graph within seconds however slowly they trickle in. `lister` is the
+    source of the listing pages, iter_commit_pages or iter_history_pages.
+    Returns the counts per stage, and the shas of the commits that failed.
+
+    `client` and `summarizer` can be shared between pipelines of several
+    repositories so they draw on one connection pool and one LLM budget.
+    With `metrics` every stage records how long each commit took in it and
+    how full its input queue is. With `resolve_sources` the changed functions
+    of Python files are resolved against the files at the commit. With
+    `skip_merge_details` merge commits get no detail request.
+    """
+    stats = {'listed': 0, 'fetched': 0, 'summarized': 0, 'ingested': 0, 'failed': 0, 'failed_shas': [],
+             'newest': None, 'first_ingest_seconds': None, 'seconds': None, 'error': None}
+    started = time.monotonic()
+    details = asyncio.Queue(queue_size)
+    summaries = asyncio.Queue(queue_size)
+    ingests = asyncio.Queue(queue_size)
+    summarizer = summarizer or Summarizer(model, summary_concurrency, host=ollama_host, cache=summary_cache,
+                                          metrics=metrics)
+    summary_workers = summary_concurrency or ollama_parallelism()
+
+    def fail(url):
+        # a commit that failed on its own, unlike a listing error or a lost ingest batch
+        stats['failed'] += 1
+        stats['failed_shas'].append(url.rsplit('/', 1)[-1])
+    # one limit for the raw file requests of every commit, like the one on detail fetches
+    sources = asyncio.Semaphore(fetch_concurrency)
+
+    async def list_commits():
+        pages = lister(url, scheduler=scheduler, **(list_kwargs or {}))
+        try:
+            while True:
+                # the listing is synchronous, keep it off the event loop
+                page = await asyncio.to_thread(next, pages, None)
+                if page is None:
+                    break
+                for commit in page:
+                    if stats['newest'] is None:
+                        stats['newest'] = commit
+                    stats['listed'] += 1
+                    await details.put(commit)
+        except Exception as e:
+            print(f"An error occurred while listing commits of {url}: {e}")
+            stats['failed'] += 1
+            stats['error'] = str(e)
+        finally:
+            pages.close()
+            for _ in range(fetch_concurrency):
+                await details.put(_DONE)
+
+    async def fetch_details(client):
+        while (commit := await details.get()) is not _DONE:
+            if metrics is not None:
+                metrics.set('pipeline_queue_depth', details.qsize(), queue='details')
+            if not needs_detail(commit, skip_merge_details):
+                detail = {}
+            else:
+                with _stage_timer(metrics, 'fetch_details'):
+                    detail = await fetch_commit_detail(client, commit.get('url', 'NONE'), scheduler=scheduler,
+                                                       cache=commit_cache)
+            if detail is None:
+                fail(commit.get('url', 'NONE'))
+                continue
+            record = commit_record(commit, detail)
+            if resolve_sources:
+                with _stage_timer(metrics, 'resolve_functions'):
+                    await resolve_functions([record], client, scheduler=scheduler, cache=commit_cache,
+                                            semaphore=sources)
+            stats['fetched'] += 1
+            await summaries.put(record)
+
+    async def summarize():
+        while (record := await summaries.get()) is not _DONE:
+            if metrics is not None:
+                metrics.set('pipeline_queue_depth', summaries.qsize(), queue='summaries')
+            with _stage_timer(metrics, 'summarize'):
+                commit = await summarizer.summarize(record)
+            if commit is None:
+                fail(record['url'])
+                continue
+            stats['summarized'] += 1
+            await ingests.put(commit)
+
+    async def write(batch):
+        ingested = await asyncio.to_thread(ingest_commits, graph, batch, batch_size, metrics=metrics)
+        stats['ingested'] += ingested
+        stats['failed'] += len(batch) - ingested
+        if stats['first_ingest_seconds'] is None and ingested:
+            stats['first_ingest_seconds'] = time.monotonic() - started
+
+    async def ingest():
+        batch = []
+        deadline = None  # when the oldest commit of the batch has waited flush_interval
+        while True:
+            try:
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                commit = await asyncio.wait_for(ingests.get(), timeout)
+            except asyncio.TimeoutError:
+                commit = None
+            if commit is not None and commit is not _DONE:
+                if metrics is not None:
+                    metrics.set('pipeline_queue_depth', ingests.qsize(), queue='ingests')
+                try:
+                    batch.append({"commit": commit, "summary": parse_summary(commit['summary']).as_dict()})
+                except SummaryParseError as e:
+                    print(f"Failed to parse summary for commit {commit['id']}: {e}")
+                    fail(commit['url'])
+                    if metrics is not None:
+                        metrics.inc('summary_parse_errors_total')
+                if batch and deadline is None:
+                    deadline = time.monotonic() + flush_interval
+            if batch and (commit is None or commit is _DONE or len(batch) >= batch_size):
+                await write(batch)
+                batch = []
+                deadline = None
+            if commit is _DONE:
+                break
+
+    async def run(client):
+        await asyncio.gather(
+            summarizer.warm_up(),  # load the model while the first commits are listed and fetched
+            list_commits(),
+            _close_after([fetch_details(client) for _ in range(fetch_concurrency)], summaries, summary_workers),
+            _close_after([summarize() for _ in range(summary_workers)], ingests, 1),
+            ingest()
+        )
+
+    if client is not None:
+        await run(client)
+    else:
+        async with make_async_client(max_connections=fetch_concurrency) as client:
+            await run(client)
+    stats['seconds'] = time.monotonic() - started
+    return stats
+
@@ -0,0 +1,230 @@
+import hashlib
+import os
+
+from summary_parser import SummaryParseError, parse_summary
+
+SUMMARY_MODEL = "llama3"
+# Model for the commits triage finds small, unset sends them to SUMMARY_MODEL too
+SMALL_SUMMARY_MODEL = os.getenv('SMALL_SUMMARY_MODEL')
+
+# Tokens of commit data sent per request, leaves room for the instructions and
+# the answer in llama3's 8k context
+PROMPT_TOKEN_BUDGET = 3000
+CHARS_PER_TOKEN = 4
+# Below this many patch characters per file a commit is split into parts instead
+MIN_PATCH_CHARS = 400
+# Parts a large commit is spread over before its files get less of their patch each
+MAX_PARTS = 8
+# Characters of each part's summary carried into a merge, and of the commit message
+PART_SUMMARY_CHARS = 1200
+MERGE_MESSAGE_CHARS = 1000
+# Most tokens an answer may take, a summary paragraph and an importance fit well within
+SUMMARY_MAX_TOKENS = 384
+# Context windows requests are sized to. Ollama reloads the model when num_ctx
+# changes, so prompts are rounded up to a few fixed sizes rather than fitted exactly
+CONTEXT_SIZES = (4096, 8192)
+# How long Ollama keeps the model loaded after the last request
+KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+
+summary_prompt = """
+                Here is a commit from a GitHub repository:
+                {commit}
+                Summarize the main changes in a short paragraph.
+                Assess the importance of this commit to the overall codebase on a scale from 1 to 5,
+                with 5 being the most crucial. Format the analysis in a compact JSON format without any new lines
+                or unnecessary spaces. Include keys 'Summary' and 'Importance'. Don't repeat the patches.
+                """
+
+part_prompt = """
+                Here is part {part} of {parts} of a large commit from a GitHub repository:
+                {commit}
+                Summarize the changes in this part.
+                Format the analysis in a compact JSON format without any new lines or unnecessary spaces.
+                Include the key 'Summary'.
+                """
+
+merge_prompt = """
+                A large commit from a GitHub repository was summarized in parts.
+                Commit message: {message}
+                Summaries of the parts: {parts}
+                Combine them into one summary of the whole commit in a short paragraph.
+                Assess the importance of this commit to the overall codebase on a scale from 1 to 5,
+                with 5 being the most crucial. Format the analysis in a compact JSON format without any new lines
+                or unnecessary spaces. Include keys 'Summary' and 'Importance'.
+                """
+
+combine_prompt = """
+                Parts of a large commit from a GitHub repository were summarized separately.
+                Commit message: {message}
+                Summaries of some of the parts: {parts}
+                Combine them into one summary of these parts.
+                Format the analysis in a compact JSON format without any new lines or unnecessary spaces.
+                Include the key 'Summary'.
+                """
+
+# Cached summaries are keyed by this, so editing the templates or the budgets invalidates them
+PROMPT_VERSION = hashlib.sha256(
+    f"{summary_prompt}{part_prompt}{merge_prompt}{combine_prompt}{PROMPT_TOKEN_BUDGET}{MAX_PARTS}"
+    f"{PART_SUMMARY_CHARS}".encode()
+).hexdigest()[:12]
+
+
+def _patch_text(file):
+    patch = file.get('patch') or ''
+    return '' if patch == 'NONE' else patch
+
+
+def diff_stats(patch):
+    added = removed = 0
+    for line in patch.splitlines():
+        if line.startswith('+'):
+            added += 1
+        elif line.startswith('-'):
+            removed += 1
+    return added, removed
+
+
+def trim_patch(patch, max_chars):
+    """Keep the hunk headers and changed lines of a patch up to max_chars, context lines are dropped"""
+    lines = []
+    size = 0
+    for line in patch.splitlines():
+        if not line.startswith(('@@', '+', '-')):
+            continue
+        if size + len(line) + 1 > max_chars:
+            lines.append('... (trimmed)')
+            break
+        lines.append(line)
+        size += len(line) + 1
+    return '\n'.join(lines)
+
+
+def render_file(file, max_patch_chars):
+    patch = _patch_text(file)
+    added, removed = diff_stats(patch)
+    text = f"File {file.get('filename', 'NONE')} (+{added} -{removed})"
+    if file.get('functions'):
+        text += f" changing {', '.join(file['functions'])}"
+    trimmed = trim_patch(patch, max_patch_chars) if max_patch_chars > 0 else ''
+    return f"{text}\n{trimmed}" if trimmed else text
+
+
+def render_commit(commit, files, max_patch_chars):
+    author = commit.get('author') or {}
+    lines = [
+        f"Message: {commit.get('commit_message', 'NONE')}",
+        f"Author: {author.get('name', 'NONE')}",
+        f"Date: {commit.get('date', 'NONE')}",
+        f"Files changed: {len(files)}",
+    ]
+    lines += [render_file(file, max_patch_chars) for file in files]
+    return '\n'.join(lines)
+
+
+def _split_files(commit, files, budget_chars, max_patch_chars):
+    """Group files into parts whose rendering fits the budget"""
+    parts = []
+    part = []
+    base = len(render_commit(commit, [], 0))
+    size = base
+    for file in files:
+        rendered = render_file(file, max_patch_chars)
+        if part and size + len(rendered) > budget_chars:
+            parts.append(part)
+            part = []
+            size = base
+        part.append(file)
+        size += len(rendered) + 1
+    if part:
+        parts.append(part)
+    return parts
+
+
+def build_summary_prompts(commit, budget=PROMPT_TOKEN_BUDGET):
+    """
+    Prompts for summarizing a commit within `budget` tokens of commit data each.
+    A single prompt is the whole summary, several are parts to summarize
+    separately and combine with merge_groups and build_merge_prompt.
+    """
+    budget_chars = budget * CHARS_PER_TOKEN
+    files = commit.get('files') or []
+    full = render_commit(commit, files, budget_chars)
+    if len(full) <= budget_chars:
+        return [summary_prompt.format(commit=full)]
+
+    # share what is left after the file list between the patches
+    headers = render_commit(commit, files, 0)
+    per_file = (budget_chars - len(headers)) // max(len(files), 1)
+    if per_file >= MIN_PATCH_CHARS:
+        return [summary_prompt.format(commit=render_commit(commit, files, per_file))]
+
+    # the patches share the room of MAX_PARTS parts, so many large files are packed
+    # several to a part instead of one part each; a file larger than a whole part
+    # gets one to itself with its patch trimmed
+    room = budget_chars - len(render_commit(commit, [], 0)) - 200
+    max_patch_chars = min(max((MAX_PARTS * room - len(headers)) // len(files), MIN_PATCH_CHARS), room)
+    parts = _split_files(commit, files, budget_chars, max_patch_chars)
+    return [
+        part_prompt.format(part=number, parts=len(parts), commit=render_commit(commit, part, max_patch_chars))
+        for number, part in enumerate(parts, start=1)
+    ]
+
+
+def part_summary_text(answer, max_chars=PART_SUMMARY_CHARS):
+    """The summary text of the answer for a part, cut to `max_chars` so a merge prompt holds many"""
+    try:
+        text = parse_summary(answer).summary
+    except SummaryParseError:
+        text = answer.strip()
+    return text if len(text) <= max_chars else f"{text[:max_chars]}... (trimmed)"
+
+
+def _merge_message(commit):
+    return (commit.get('commit_message') or 'NONE')[:MERGE_MESSAGE_CHARS]
+
+
+def merge_groups(commit, part_answers, budget=PROMPT_TOKEN_BUDGET):
+    """
+    The trimmed summaries of the answers for the parts of a commit, grouped so
+    the merge prompt of every group fits `budget` tokens. A group holds at
+    least two, so merging each group into one summary always leaves fewer.
+    """
+    budget_chars = budget * CHARS_PER_TOKEN - len(merge_prompt) - len(_merge_message(commit))
+    groups = []
+    group = []
+    size = 0
+    for text in map(part_summary_text, part_answers):
+        if len(group) >= 2 and size + len(text) + 1 > budget_chars:
+            groups.append(group)
+            group = []
+            size = 0
+        group.append(text)
+        size += len(text) + 1
+    if group:
+        groups.append(group)
+    return groups
+
+
+def build_merge_prompt(commit, part_summaries, final=True):
+    """
+    The prompt merging summaries of parts of a commit, the whole commit's
+    summary when `final`, otherwise one summary of just these parts.
+    """
+    template = merge_prompt if final else combine_prompt
+    return template.format(message=_merge_message(commit), parts=' '.join(part_summaries))
+
+
+def request_options(content):
+    """Ollama options for a prompt: the smallest context that holds it and its answer, and the answer length"""
+    needed = len(content) // CHARS_PER_TOKEN + SUMMARY_MAX_TOKENS
+    num_ctx = next((size for size in CONTEXT_SIZES if size >= needed), CONTEXT_SIZES[-1])
+    return {'num_ctx': num_ctx, 'num_predict': SUMMARY_MAX_TOKENS}
+
+
+def chat_messages(content):
+    return [
+        {
+            'role': 'user',
+            'content': content
+        }
+    ]
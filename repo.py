@@ -1,32 +1,14 @@
 import httpx
-from ollama import AsyncClient
 import ollama
 from dotenv import load_dotenv
 import pprint
 import os
-import json
 
 load_dotenv('.env', override=True)
 
-import json
-import re
-
-
-def parse_stringified_json(obj):
-    if isinstance(obj, dict):
-        for key, value in obj.items():
-            obj[key] = parse_stringified_json(value)
-    elif isinstance(obj, list):
-        return [parse_stringified_json(item) for item in obj]
-    elif isinstance(obj, str):
-        # Try to detect and parse stringified JSON
-        try:
-            # Use regex to detect if the string looks like a JSON object or array
-            if re.match(r'^\[.*\]$', obj.strip()) or re.match(r'^\{.*\}$', obj.strip()):
-                return parse_stringified_json(json.loads(obj))
-        except json.JSONDecodeError:
-            pass
-    return obj
+from github_api import commit_files, fetch_commit_details
+from summarize import summarize_commits
+from summary_parser import SummaryParseError, parse_summary
 
 
 def get_repo_commits(url):
@@ -35,7 +17,7 @@ def get_repo_commits(url):
 
     try:
         response = httpx.get(url, headers=headers)
-        print(httpx.get('https://api.github.com/rate_limit', headers=headers).json(), ' Rate limit')
+        print(response.headers.get('x-ratelimit-remaining'), ' Rate limit remaining')
         # response = httpx.get(url)
         response.raise_for_status()  # Raises an HTTPError if the response status is 4xx, 5xx
         data = response.json()
@@ -51,29 +33,16 @@ def get_repo_commits(url):
 
 async def get_commit_info(data):
     result_list = []
-    for commit in data:
+    details = await fetch_commit_details([commit.get('url', 'NONE') for commit in data])
+    for commit, files_data in zip(data, details):
         try:
             commit_message = commit.get('commit', {}).get('message', 'NONE')
             author = commit.get('commit', {}).get('author', {})
             date = commit.get('commit', {}).get('author', {}).get('date', 'NONE')
             url = commit.get('url', 'NONE')
-            async with httpx.AsyncClient() as client:
-                print(f"Getting data from {url}")
-                files_commit = await client.get(url)
-                files_commit.raise_for_status()
-                files_data = files_commit.json()
-
-            files = []
-            for file in files_data.get('files', []):
-                filename = file.get('filename', 'NONE')
-                patch = file.get('patch', 'NONE')
-                raw_url = file.get('raw_url', 'NONE')
-
-                files.append({
-                    "filename": filename,
-                    "patch": patch,
-                    "raw_url": raw_url
-                })
+            if files_data is None:
+                continue
+            files = commit_files(files_data)
 
             result_list.append({
                 "commit_message": commit_message,
@@ -123,9 +92,13 @@ async def main():
     url = "https://api.github.com/repos/prefecthq/prefect/commits"
     data = get_repo_commits(url)
     commits = await get_commit_info(data[0:1])
-    for commit in commits:
-        summary = get_repo_summary(commit)
-        commit['summary'] = parse_stringified_json(summary)
+    for commit in await summarize_commits(commits):
+        if commit is None:
+            continue
+        try:
+            commit['summary'] = parse_summary(commit['summary'])
+        except SummaryParseError as e:
+            print(f"An error occurred: {e}")
         pprint.pprint(commit)
 
 
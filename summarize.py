@@ -0,0 +1,249 @@
+import asyncio
+import os
+import time
+
+from ollama import AsyncClient
+
+from metrics import RATE_BUCKETS
+from prompts import (CHARS_PER_TOKEN, CONTEXT_SIZES, KEEP_ALIVE, PROMPT_VERSION, SMALL_SUMMARY_MODEL, SUMMARY_MODEL,
+                     build_merge_prompt, build_summary_prompts, chat_messages, merge_groups, request_options)
+from summary_parser import ObjectScanner, SummaryParseError, parse_summary
+from triage import SKIP, SMALL, classify, templated_summary
+
+
+def is_usable(summary):
+    """Whether a model answer parses into a summary, an unusable one is never cached"""
+    try:
+        parse_summary(summary)
+    except SummaryParseError:
+        return False
+    return True
+
+
+def ollama_parallelism():
+    """How many requests the Ollama server runs at once, OLLAMA_NUM_PARALLEL on the server side"""
+    return int(os.getenv('OLLAMA_NUM_PARALLEL', 4))
+
+
+class Summarizer:
+    """
+    Summarizes commits with up to `concurrency` chat requests in flight on one
+    ollama.AsyncClient, however many commits are being summarized at once.
+
+    Commits too large for one prompt are summarized in parts that are then
+    merged, in rounds when their summaries don't fit one merge prompt. With `metrics` every request records its
+    latency and the token counts Ollama reports.
+
+    With `triage` trivial commits (merges, lock files, docs, formatting) get a
+    templated summary without a request, and small ones go to `small_model`
+    when there is one.
+
+    With `stream` answers are read as they are generated and the request is
+    closed as soon as a whole JSON object has arrived, which stops Ollama
+    generating the rest. The models are loaded before the first request and
+    kept loaded for `keep_alive`.
+    """
+
+    def __init__(self, model=SUMMARY_MODEL, concurrency=None, timeout=300, host=None, cache=None, metrics=None,
+                 small_model=SMALL_SUMMARY_MODEL, triage=True, stream=True, keep_alive=KEEP_ALIVE):
+        self.model = model
+        self.small_model = small_model
+        self.triage = triage
+        self.stream = stream
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.cache = cache
+        self.metrics = metrics
+        self.client = AsyncClient(host=host)
+        self._semaphore = asyncio.Semaphore(concurrency or ollama_parallelism())
+        self._warm_up = None
+
+    async def warm_up(self):
+        """
+        Load the models with the context most requests use and pin them for
+        `keep_alive`, once however many callers wait on it. A failure is only
+        reported, the first request loads the model then.
+        """
+        if self._warm_up is None:
+            self._warm_up = asyncio.ensure_future(self._load_models())
+        await self._warm_up
+
+    async def _load_models(self):
+        for model in dict.fromkeys(filter(None, (self.model, self.small_model))):
+            started = time.perf_counter()
+            try:
+                # an empty prompt loads the model without generating anything
+                await asyncio.wait_for(self.client.generate(model=model, prompt='', keep_alive=self.keep_alive,
+                                                            options={'num_ctx': CONTEXT_SIZES[0]}), self.timeout)
+            except Exception as e:
+                print(f"An error occurred while loading model {model}: {e}")
+                continue
+            if self.metrics is not None:
+                self.metrics.observe('ollama_load_seconds', time.perf_counter() - started, model=model)
+
+    async def chat(self, content, model=None):
+        await self.warm_up()
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                if self.stream:
+                    text, response = await asyncio.wait_for(self._stream_chat(content, model or self.model, started),
+                                                            self.timeout)
+                else:
+                    response = await asyncio.wait_for(
+                        self.client.chat(model=model or self.model, format='json', stream=False,
+                                         messages=chat_messages(content), options=request_options(content),
+                                         keep_alive=self.keep_alive),
+                        self.timeout
+                    )
+                    text = response['message']['content']
+            except Exception as e:
+                if self.metrics is not None:
+                    self.metrics.inc('ollama_requests_total', status=type(e).__name__)
+                raise
+        if self.metrics is not None:
+            self.observe(response, time.perf_counter() - started)
+        return text
+
+    async def _stream_chat(self, content, model, started):
+        """
+        Stream a chat answer until it holds a complete JSON object or ends.
+        Returns the answer and the last chunk. Ollama only reports token
+        counts in the final chunk, for an answer cut short they are estimated
+        from the prompt length, the chunks read (a token each) and the time
+        since the first one.
+        """
+        chunks = await self.client.chat(model=model, format='json', stream=True, messages=chat_messages(content),
+                                        options=request_options(content), keep_alive=self.keep_alive)
+        scanner = ObjectScanner()
+        chunk = {}
+        pieces = 0
+        first = last = None
+        try:
+            async for chunk in chunks:
+                last = time.perf_counter()
+                if first is None:
+                    first = last
+                    if self.metrics is not None:
+                        self.metrics.observe('ollama_first_token_seconds', first - started)
+                pieces += 1
+                if scanner.feed(chunk.get('message', {}).get('content', '')):
+                    break
+        finally:
+            # closing the stream drops the connection, Ollama stops generating for it
+            await chunks.aclose()
+        if self.metrics is not None:
+            self.metrics.inc('ollama_streamed_tokens_total', pieces)
+        if not chunk.get('done'):
+            if self.metrics is not None:
+                self.metrics.inc('ollama_early_stops_total')
+            chunk = {'prompt_eval_count': len(content) // CHARS_PER_TOKEN, 'eval_count': pieces,
+                     'eval_duration': (last - first) * 1e9 if pieces > 1 else 0}
+        return scanner.output(), chunk
+
+    def observe(self, response, seconds):
+        """Record a chat response, Ollama reports token counts and durations in nanoseconds"""
+        metrics = self.metrics
+        metrics.inc('ollama_requests_total', status='ok')
+        metrics.observe('ollama_request_seconds', seconds)
+        metrics.inc('ollama_prompt_tokens_total', response.get('prompt_eval_count') or 0)
+        metrics.inc('ollama_eval_tokens_total', response.get('eval_count') or 0)
+        eval_seconds = (response.get('eval_duration') or 0) / 1e9
+        metrics.inc('ollama_eval_seconds_total', eval_seconds)
+        if eval_seconds:
+            metrics.observe('ollama_eval_tokens_per_second', response.get('eval_count', 0) / eval_seconds,
+                            buckets=RATE_BUCKETS)
+        if response.get('done_reason') == 'length':
+            # the answer hit num_predict, it is cut off and won't parse
+            metrics.inc('ollama_truncated_answers_total')
+
+    async def merge(self, commit, parts, model=None):
+        """
+        Merge the answers for the parts of a commit into its summary. When
+        they don't fit one prompt they are merged in rounds, every group that
+        fits combined into one summary, until a single prompt holds them all.
+        """
+        async def combine(group):
+            if len(group) == 1:
+                return group[0]
+            return await self.chat(build_merge_prompt(commit, group, final=False), model)
+
+        groups = merge_groups(commit, parts)
+        while len(groups) > 1:
+            parts = await asyncio.gather(*(combine(group) for group in groups))
+            groups = merge_groups(commit, parts)
+        return await self.chat(build_merge_prompt(commit, groups[0]), model)
+
+    async def summarize(self, commit):
+        """The commit with its 'summary' set, None when a request failed or timed out"""
+        model = self.model
+        if self.triage:
+            decision, reason = classify(commit)
+            if self.metrics is not None:
+                self.metrics.inc('triage_decisions_total', decision=decision, reason=reason)
+            if decision == SKIP:
+                commit['summary'] = templated_summary(commit, reason)
+                return commit
+            if decision == SMALL and self.small_model:
+                model = self.small_model
+        if self.cache is not None:
+            cached = self.cache.get_summary(commit['url'], model, PROMPT_VERSION)
+            # earlier versions cached whatever came back, a broken answer is asked for again
+            if cached is not None and is_usable(cached):
+                commit['summary'] = cached
+                return commit
+        prompts = build_summary_prompts(commit)
+        try:
+            if len(prompts) == 1:
+                commit['summary'] = await self.chat(prompts[0], model)
+            else:
+                parts = await asyncio.gather(*(self.chat(prompt, model) for prompt in prompts))
+                commit['summary'] = await self.merge(commit, parts, model)
+        except asyncio.TimeoutError:
+            print(f"Summary of commit {commit['url']} timed out after {self.timeout}s")
+            return None
+        except Exception as e:
+            print(f"An error occurred while summarizing commit {commit['url']}: {e}")
+            return None
+        if not is_usable(commit['summary']):
+            # malformed or cut off at the length limit, left to fail parsing downstream and asked for again next run
+            print(f"Unusable summary of commit {commit['url']}, not caching it")
+            if self.metrics is not None:
+                self.metrics.inc('ollama_unusable_answers_total')
+        elif self.cache is not None:
+            self.cache.put_summary(commit['url'], model, PROMPT_VERSION, commit['summary'])
+        return commit
+
+
+async def summarize_commits(commits, model=SUMMARY_MODEL, concurrency=None, timeout=300, host=None, cache=None,
+                            metrics=None):
+    """Summarize commits concurrently, results come back in the order of `commits`"""
+    summarizer = Summarizer(model, concurrency, timeout, host, cache, metrics)
+    return await asyncio.gather(*(summarizer.summarize(commit) for commit in commits))
+
+
+async def summarize_refs(refs, store, model=SUMMARY_MODEL, concurrency=None, timeout=300, host=None, cache=None,
+                         metrics=None):
+    """
+    Summarize the commits behind CommitRefs, loading each record from the
+    RecordStore only while its summary is being written so no more than
+    `concurrency` records are held at once. Returns the refs with their
+    summary set, None for the ones that failed, in the order of `refs`.
+    """
+    summarizer = Summarizer(model, concurrency, timeout, host, cache, metrics)
+    loaded = asyncio.Semaphore(concurrency or ollama_parallelism())
+
+    async def summarize(ref):
+        async with loaded:
+            try:
+                commit = store.load(ref)
+            except KeyError as e:
+                print(f"An error occurred: {e}")
+                return None
+            commit = await summarizer.summarize(commit)
+        if commit is None:
+            return None
+        ref.summary = commit['summary']
+        return ref
+
+    return await asyncio.gather(*(summarize(ref) for ref in refs))
@@ -0,0 +1,219 @@
+import ast
+import json
+import re
+from dataclasses import dataclass, field
+
+_decoder = json.JSONDecoder()
+_TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+_IMPORTANCE_RE = re.compile(r'[1-5]')
+
+
+class SummaryParseError(ValueError):
+    pass
+
+
+@dataclass
+class Summary:
+    summary: str
+    importance: int = None
+    files: list = field(default_factory=list)
+    functions: list = field(default_factory=list)
+
+    def as_dict(self):
+        """The shape the graph ingest reads"""
+        return {
+            'Files': self.files,
+            'Functions': self.functions,
+            'Summary': self.summary,
+            'Importance': self.importance
+        }
+
+
+def _balanced_object(text, start):
+    """The {...} starting at `start`, matched while skipping over quoted strings"""
+    depth = 0
+    quote = None
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]
+
+
+class ObjectScanner:
+    """
+    Follows streamed model output piece by piece, the incremental form of
+    _balanced_object, to tell when the first {...} is complete without
+    rescanning what came before.
+    """
+
+    def __init__(self):
+        self.text = []
+        self.size = 0
+        self.start = None
+        self.end = None
+        self._depth = 0
+        self._quote = None
+        self._escaped = False
+
+    def feed(self, piece):
+        """Add a piece of output, returns whether the object is complete"""
+        offset = self.size
+        self.text.append(piece)
+        self.size += len(piece)
+        if self.end is not None:
+            return True
+        for i, char in enumerate(piece, offset):
+            if self._quote:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == self._quote:
+                    self._quote = None
+            elif self.start is None:
+                if char == '{':
+                    self.start = i
+                    self._depth = 1
+            elif char in '"\'':
+                self._quote = char
+            elif char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    self.end = i + 1
+                    return True
+        return False
+
+    def output(self):
+        """The object when it is complete, everything seen so far when not"""
+        text = ''.join(self.text)
+        return text[self.start:self.end] if self.end is not None else text
+
+
+def _strip_fence(text):
+    # plain string checks, a regex anchored at the end rescans every whitespace run of a large payload
+    text = text.strip()
+    if text.startswith('```'):
+        newline = text.find('\n')
+        text = text[newline + 1:] if newline != -1 else text[3:]
+        if text.rstrip().endswith('```'):
+            text = text.rstrip()[:-3]
+    return text
+
+
+def decode_object(text):
+    """
+    Decode the first JSON object in model output. Code fences and any text
+    around the object are ignored, trailing commas and Python style quoting
+    are repaired.
+    """
+    text = _strip_fence(text)
+    start = text.find('{')
+    if start == -1:
+        raise SummaryParseError(f"No JSON object in model output: {text[:100]!r}")
+    try:
+        return _decoder.raw_decode(text, start)[0]
+    except json.JSONDecodeError:
+        pass
+    candidate = _TRAILING_COMMA_RE.sub(r'\1', _balanced_object(text, start))
+    try:
+        return _decoder.raw_decode(candidate)[0]
+    except json.JSONDecodeError:
+        pass
+    try:
+        # single quotes, True/False/None
+        value = ast.literal_eval(candidate)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        raise SummaryParseError(f"Unable to repair model output: {text[:100]!r}") from None
+    if not isinstance(value, dict):
+        raise SummaryParseError(f"Model output is not an object: {text[:100]!r}")
+    return value
+
+
+def _lookup(data, key):
+    if key in data:
+        return data[key]
+    lowered = key.lower()
+    for name, value in data.items():
+        if isinstance(name, str) and name.lower() == lowered:
+            return value
+    return None
+
+
+def _names(value, keys, top=True):
+    """Flatten a model provided list of names, entries may be strings, objects or stringified lists"""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        stripped = value.strip()
+        if stripped.startswith('['):
+            try:
+                return _names(json.loads(stripped), keys, False)
+            except json.JSONDecodeError:
+                pass
+        if top:
+            # a bare string instead of a list, "a, b"
+            return [name.strip() for name in stripped.split(',') if name.strip()]
+        return [stripped] if stripped else []
+    if isinstance(value, dict):
+        for key in keys:
+            name = _lookup(value, key)
+            if isinstance(name, str):
+                return [name]
+        # {"file.py": ["f", "g"]} or {"functions": [...]}
+        return [name for nested in value.values() if isinstance(nested, (list, tuple))
+                for name in _names(nested, keys, False)]
+    if isinstance(value, (list, tuple)):
+        return [name for item in value for name in _names(item, keys, False)]
+    return [str(value)]
+
+
+def _importance(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return min(max(int(round(value)), 1), 5)
+    if isinstance(value, str):
+        match = _IMPORTANCE_RE.search(value)
+        return int(match.group()) if match else None
+    return None
+
+
+def _unique(names):
+    return list(dict.fromkeys(names))
+
+
+def parse_summary(output):
+    """
+    Parse and validate a summary produced by the model, a JSON string or an
+    already decoded dict. The input is never modified. Raises
+    SummaryParseError when there is no usable summary.
+    """
+    data = output if isinstance(output, dict) else decode_object(output)
+    summary = _lookup(data, 'Summary')
+    if isinstance(summary, (dict, list)):
+        summary = json.dumps(summary)
+    if not isinstance(summary, str) or not summary.strip():
+        raise SummaryParseError(f"Summary is missing from model output: {str(output)[:100]!r}")
+    return Summary(
+        summary=summary.strip(),
+        importance=_importance(_lookup(data, 'Importance')),
+        files=_unique(_names(_lookup(data, 'Files'), ('filename', 'file', 'name'))),
+        functions=_unique(_names(_lookup(data, 'Functions'), ('name', 'function')))
+    )
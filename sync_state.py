@@ -0,0 +1,97 @@
+import json
+import os
+import threading
+
+# Runs a commit may fail in before the mark moves past it anyway
+MAX_ATTEMPTS = 3
+
+
+class SyncState:
+    """
+    Per repository high-water mark of the last ingested commit, kept in a JSON
+    file so scheduled runs only pick up what was committed since. Commits that
+    failed are counted with the mark, so one that keeps failing holds it back
+    for MAX_ATTEMPTS runs and not forever.
+    """
+
+    def __init__(self, path='.cache/sync_state.json'):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self._marks = json.load(f)
+        except FileNotFoundError:
+            self._marks = {}
+
+    def get(self, repo):
+        """The {'sha', 'date'} mark of a repository, None before its first sync"""
+        mark = self._marks.get(repo)
+        # a repository whose first sync failed has failure counts but no mark yet
+        return mark if mark and mark.get('sha') else None
+
+    def set(self, repo, sha, date):
+        with self._lock:
+            self._marks[repo] = {'sha': sha, 'date': date}
+            self._save()
+
+    def settle(self, repo, newest, listed, ingested, failed, max_attempts=MAX_ATTEMPTS):
+        """
+        Record a run over `listed` commits up to `newest` (sha, date) that
+        ingested `ingested` of them and failed the ones whose shas are in
+        `failed`. The mark moves to `newest` once every failed commit has
+        failed `max_attempts` runs, until then they are listed again. A run
+        with failures not pinned on a commit, a lost ingest batch, never
+        moves it. Returns whether the mark moved.
+        """
+        if ingested + len(failed) != listed:
+            return False
+        with self._lock:
+            entry = self._marks.get(repo) or {}
+            counts = entry.get('failures', {})
+            failures = {sha: counts.get(sha, 0) + 1 for sha in failed}
+            if any(attempts < max_attempts for attempts in failures.values()):
+                self._marks[repo] = {**entry, 'failures': failures}
+                self._save()
+                return False
+            for sha, attempts in failures.items():
+                print(f"Giving up on commit {sha} of {repo} after {attempts} failed runs")
+            self._marks[repo] = {'sha': newest[0], 'date': newest[1]}
+            self._save()
+        return True
+
+    def advance(self, repo, stats, max_attempts=MAX_ATTEMPTS):
+        """
+        Settle a pipeline run, a run that stopped with an error never moves
+        the mark. Returns whether it moved.
+        """
+        if stats.get('newest') is None or stats.get('error'):
+            return False
+        return self.settle(repo, listing_watermark(stats['newest']), stats['listed'], stats['ingested'],
+                           stats.get('failed_shas') or [], max_attempts)
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self._marks, f, indent=2)
+        os.replace(tmp, self.path)  # never leave a half written state file behind
+
+
+def listing_watermark(commit):
+    """The mark for a commit of the /commits listing"""
+    info = commit.get('commit', {})
+    date = (info.get('committer') or info.get('author') or {}).get('date')
+    return commit.get('sha'), date
+
+
+def record_watermark(ref):
+    """The mark for the CommitRef of a record, for sources that have no listing"""
+    return ref.sha, ref.date
+
+
+def listing_kwargs(mark, max_pages=None):
+    """Arguments for iter_commit_pages that list everything after a mark, or the whole history without one"""
+    kwargs = {'per_page': 100, 'max_pages': max_pages}
+    if mark:
+        kwargs.update(since=mark['date'], stop_at_sha=mark['sha'])
+    return kwargs
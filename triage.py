@@ -0,0 +1,136 @@
+import json
+import posixpath
+import re
+
+from prompts import _patch_text, diff_stats
+
+# What triage decides for a commit
+SKIP = 'skip'  # templated summary, no LLM request
+SMALL = 'small'  # summarized by the small model
+FULL = 'full'  # summarized by the main model
+
+# Commits changing at most this many lines, in no more files, are small enough for the small model
+SMALL_CHANGED_LINES = 20
+SMALL_FILES = 2
+
+_MERGE_RE = re.compile(r"^Merge (pull request #\d+|branch '|remote-tracking branch '|tag '|commit '|[0-9a-f]{7,40} into )")
+_BUMP_RE = re.compile(r'^(build\(deps(-dev)?\): )?(bump|update|upgrade) \S+ (from \S+ )?to \S+', re.IGNORECASE)
+
+LOCKFILES = {
+    'package-lock.json', 'npm-shrinkwrap.json', 'yarn.lock', 'pnpm-lock.yaml', 'poetry.lock', 'pipfile.lock',
+    'pdm.lock', 'uv.lock', 'cargo.lock', 'go.sum', 'gemfile.lock', 'composer.lock', 'packages.lock.json',
+}
+MANIFESTS = {
+    'package.json', 'pyproject.toml', 'setup.cfg', 'pipfile', 'cargo.toml', 'go.mod', 'gemfile', 'composer.json',
+}
+DOC_EXTENSIONS = {'.md', '.rst', '.adoc'}
+# Files where indentation is syntax, only whitespace inside their lines can change without changing behavior
+INDENTED_EXTENSIONS = {'.py', '.pyi', '.pyw', '.yaml', '.yml', '.mk', '.coffee', '.haml', '.pug', '.sass', '.nim'}
+INDENTED_FILES = {'makefile', 'gnumakefile'}
+DOC_DIRECTORIES = ('docs/', 'doc/')
+
+
+def _is_lockfile(filename):
+    return posixpath.basename(filename).lower() in LOCKFILES
+
+
+def _is_requirements(filename):
+    name = posixpath.basename(filename).lower()
+    return name.startswith('requirements') and name.endswith(('.txt', '.in'))
+
+
+def _is_doc(filename):
+    lower = filename.lower()
+    return lower.startswith(DOC_DIRECTORIES) or posixpath.splitext(lower)[1] in DOC_EXTENSIONS
+
+
+def _changed_lines(patch):
+    removed = []
+    added = []
+    for line in patch.splitlines():
+        if line.startswith('-'):
+            removed.append(line[1:])
+        elif line.startswith('+'):
+            added.append(line[1:])
+    return removed, added
+
+
+def _indentation_matters(filename):
+    name = posixpath.basename(filename).lower()
+    return name in INDENTED_FILES or posixpath.splitext(name)[1] in INDENTED_EXTENSIONS
+
+
+def _formatting_only(patch, filename=''):
+    """
+    Whether the changed lines of a patch differ only in how much whitespace
+    separates their words: a run of spaces may grow or shrink, but never
+    appear or vanish, since "a b" and "ab" mean different things. Lines may
+    be reflowed, except in files where indentation is syntax, where the lines
+    and their indentation must stay the same and only blank lines may change.
+    """
+    removed, added = _changed_lines(patch)
+    if not removed and not added:
+        return False
+
+    if _indentation_matters(filename):
+        def squeeze(lines):
+            return [line[:len(line) - len(line.lstrip())] + ' '.join(line.split()) for line in lines if line.strip()]
+    else:
+        def squeeze(lines):
+            return ' '.join(' '.join(lines).split())
+
+    return squeeze(removed) == squeeze(added)
+
+
+def classify(commit):
+    """
+    Decide from the message, file names and diff stats of a commit record
+    whether it needs an LLM summary. Returns (decision, reason), decision
+    being SKIP, SMALL or FULL.
+    """
+    message = (commit.get('commit_message') or '').strip()
+    files = commit.get('files') or []
+    filenames = [file.get('filename') or '' for file in files]
+    patches = [_patch_text(file) for file in files]
+
+    if _MERGE_RE.match(message) or len(commit.get('parents') or []) > 1:
+        return SKIP, 'merge'
+    if not files:
+        return SKIP, 'no_files'
+    if all(_is_lockfile(name) for name in filenames):
+        return SKIP, 'lockfile'
+    if _BUMP_RE.match(message) and all(
+            _is_lockfile(name) or _is_requirements(name) or posixpath.basename(name).lower() in MANIFESTS
+            for name in filenames):
+        return SKIP, 'dependency_bump'
+    if all(_is_doc(name) for name in filenames):
+        return SKIP, 'docs'
+    if all(_formatting_only(patch, name) for patch, name in zip(patches, filenames)):
+        return SKIP, 'formatting'
+
+    changed = sum(sum(diff_stats(patch)) for patch in patches)
+    if changed <= SMALL_CHANGED_LINES and len(files) <= SMALL_FILES:
+        return SMALL, 'small_diff'
+    return FULL, 'default'
+
+
+_TEMPLATES = {
+    'merge': "Merge commit: {message}",
+    'no_files': "Commit without file changes: {message}",
+    'lockfile': "Updates the dependency lock files {files}.",
+    'dependency_bump': "Dependency update: {message}",
+    'docs': "Documentation change to {files}: {message}",
+    'formatting': "Formatting only change to {files}, no change in behavior.",
+}
+
+
+def templated_summary(commit, reason):
+    """The summary JSON written for a skipped commit, in the shape the model answers in"""
+    filenames = [file.get('filename', 'NONE') for file in commit.get('files') or []]
+    message = (commit.get('commit_message') or '').strip().splitlines()
+    return json.dumps({
+        'Files': filenames,
+        'Functions': [],
+        'Summary': _TEMPLATES[reason].format(message=message[0] if message else '', files=', '.join(filenames)),
+        'Importance': 1
+    })